@@ -3,8 +3,18 @@ import json
 import random
 import string
 import re
+import hashlib
+import gzip
+import mimetypes
+import shutil
+import threading
+import click
+import sqlite3
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import lru_cache, wraps
 from flask import (
     Flask,
     render_template,
@@ -15,6 +25,9 @@ from flask import (
     session,
     jsonify,
     abort,
+    g,
+    has_request_context,
+    send_from_directory,
 )
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired  # reset tokens
 try:
@@ -23,7 +36,18 @@ try:
     GOOGLE_SHEETS_AVAILABLE = True
 except ImportError:
     GOOGLE_SHEETS_AVAILABLE = False
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from flask_login import (
     LoginManager,
     UserMixin,
@@ -33,12 +57,12 @@ from flask_login import (
     current_user,
 )
 from flask_mail import Mail, Message
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from slugify import slugify
 from dotenv import load_dotenv
-from markupsafe import escape
+from markupsafe import escape, Markup
 from datetime import time
+import time as time_module
 load_dotenv()
 
 # ---------- STRIPE CONFIG & LOGGING ----------
@@ -52,6 +76,8 @@ logger = logging.getLogger(__name__)
 # Log Google Sheets availability after logger is initialized
 if not GOOGLE_SHEETS_AVAILABLE:
     logger.warning("Google Sheets libraries not installed. Install gspread and google-auth to enable.")
+if not PIL_AVAILABLE:
+    logger.warning("Pillow not installed. Coach photos will be served without resized variants.")
 
 # Stripe environment vars (set these in .env locally, and in Render secrets in production)
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
@@ -76,9 +102,11 @@ app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key-change-this")
 serializer = URLSafeTimedSerializer(app.secret_key)
 # ---- EMAIL CONFIGURATION (GMAIL) ----
-app.config["MAIL_SERVER"] = "smtp.gmail.com"
-app.config["MAIL_PORT"] = 587
-app.config["MAIL_USE_TLS"] = True
+# MAIL_SERVER / MAIL_PORT / MAIL_USE_TLS can point at a local SMTP stand-in,
+# e.g. `python -m aiosmtpd -n -l localhost:1025` with MAIL_USE_TLS=false
+app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", "587"))
+app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "true").lower() == "true"
 app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
 app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
 app.config["MAIL_DEFAULT_SENDER"] = "sudiksha746@gmail.com"
@@ -110,6 +138,80 @@ ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
+# ---- Cache Configuration ----
+class MemoryCache:
+    """Per-process TTL cache."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time_module.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time_module.time() + ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class FileCache:
+    """
+    TTL cache stored as JSON files in a local directory, so every gunicorn
+    worker on the host shares it. Values must be JSON-serializable.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as fh:
+                item = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if item["expires_at"] < time_module.time():
+            return None
+        return item["value"]
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump({"expires_at": time_module.time() + ttl, "value": value}, fh)
+        os.replace(tmp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def create_cache(backend):
+    if backend == "file":
+        return FileCache(os.getenv("CACHE_DIR", os.path.join(BASE_DIR, "instance", "cache")))
+    return MemoryCache()
+
+
+# CACHE_BACKEND: "memory" (per worker) or "file" (shared by workers on one host)
+cache = create_cache(os.getenv("CACHE_BACKEND", "memory"))
+
 # Login Manager Configuration
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
@@ -141,17 +243,26 @@ SPORTS_LIST = [
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def normalize_search_key(value):
+    """Normalized key used for indexed exact filters ("Table Tennis" -> "table-tennis")."""
+    return slugify(value or "")
+
 def compute_coach_badge(coach):
     # Ensure rating and experience are not None
     rating = coach.rating or 0
     exp = coach.experience_years or 0
 
     if coach.is_verified:
-        if exp >= 5 and rating >= 4.5:
+        # Verified gets at least Standard
+        if rating >= 4.7 and exp >= 5:
             return "Elite Coach"
-        if exp >= 2 and rating >= 4.0:
-            return "Standard Coach"
-        return "Verified Coach"
+        if rating >= 4.3 and exp >= 2:
+            return "Premium Coach"
+        return "Standard Coach"
+
+    # Not verified but experienced
+    if rating >= 4.5 and exp >= 3:
+        return "Trusted Coach"
     return None
 
 # ---------------------------------
@@ -298,31 +409,131 @@ def validate_json_input(data, required_fields=None, field_types=None):
     return True, "Valid input"
 
 
-# Rate limiting storage (in production, use Redis)
-_rate_limit_storage = {}
+# ---------- RATE LIMITING ----------
+# Token bucket per (route, client): capacity max_requests, refilled at
+# max_requests / window_seconds tokens per second. O(1) per request.
+class MemoryRateLimitStore:
+    """Token buckets in a bounded LRU dict (per process)."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, capacity, refill_per_second):
+        """Take one token for key; returns False if the bucket is empty."""
+        now = time_module.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)  # most recently used goes last
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+
+class SQLiteRateLimitStore:
+    """
+    Token buckets in a local SQLite file, shared by every gunicorn worker
+    on the host so the configured limit is the real limit.
+    """
+
+    EVICT_EVERY = 1000  # new keys between LRU trims
+
+    def __init__(self, path, max_keys=100000):
+        self.path = path
+        self.max_keys = max_keys
+        self._local = threading.local()
+        self._new_keys = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_limit_updated_at ON rate_limit (updated_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # limiter state needn't survive power loss
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, capacity, refill_per_second):
+        now = time_module.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limit WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO rate_limit (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, "
+                "updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            if row is None:
+                self._new_keys += 1
+                if self._new_keys % self.EVICT_EVERY == 0:
+                    # Keep the max_keys most recently used buckets
+                    conn.execute(
+                        "DELETE FROM rate_limit WHERE key IN ("
+                        "SELECT key FROM rate_limit ORDER BY updated_at DESC "
+                        "LIMIT -1 OFFSET ?)",
+                        (self.max_keys,),
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+def create_rate_limit_store(backend):
+    if backend == "sqlite":
+        return SQLiteRateLimitStore(
+            os.getenv("RATE_LIMIT_DB", os.path.join(BASE_DIR, "instance", "rate_limit.db"))
+        )
+    return MemoryRateLimitStore()
+
+
+# RATE_LIMIT_BACKEND: "memory" (per worker) or "sqlite" (shared by workers on one host)
+rate_limit_store = create_rate_limit_store(os.getenv("RATE_LIMIT_BACKEND", "memory"))
 
 
 def rate_limit(max_requests=5, window_seconds=60):
-    """Simple rate limiting decorator"""
+    """Token-bucket rate limiting decorator"""
+    refill_per_second = max_requests / window_seconds
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             client_id = request.remote_addr
             key = f"{f.__name__}:{client_id}"
-            now = datetime.now()
-            
-            if key in _rate_limit_storage:
-                requests, window_start = _rate_limit_storage[key]
-                if (now - window_start).seconds < window_seconds:
-                    if requests >= max_requests:
-                        logger.warning(f"Rate limit exceeded for {client_id} on {f.__name__}")
-                        return jsonify({"error": "Rate limit exceeded. Please try again later."}), 429
-                    _rate_limit_storage[key] = (requests + 1, window_start)
-                else:
-                    _rate_limit_storage[key] = (1, now)
-            else:
-                _rate_limit_storage[key] = (1, now)
-            
+
+            try:
+                allowed = rate_limit_store.hit(key, max_requests, refill_per_second)
+            except Exception as e:
+                # Fail open: a limiter outage shouldn't take routes down
+                logger.error(f"Rate limiter error: {e}")
+                allowed = True
+
+            if not allowed:
+                logger.warning(f"Rate limit exceeded for {client_id} on {f.__name__}")
+                return jsonify({"error": "Rate limit exceeded. Please try again later."}), 429
+
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -391,16 +602,33 @@ def get_weekday(date_obj):
     return date_obj.weekday()
 
 
-def generate_time_slots(start_time, end_time, duration_minutes=30):
-    slots = []
-    current = datetime.combine(datetime.today(), start_time)
-    end = datetime.combine(datetime.today(), end_time)
+# Length of a booking when no availability window says otherwise
+DEFAULT_SESSION_MINUTES = 30
+
 
-    while current + timedelta(minutes=duration_minutes) <= end:
-        slots.append(current.time().strftime("%H:%M"))
-        current += timedelta(minutes=duration_minutes)
+def to_minutes(value):
+    """Minutes since midnight for a time object or an "H:MM"/"HH:MM" string."""
+    if isinstance(value, str):
+        hours, minutes = value.split(":")[:2]
+        return int(hours) * 60 + int(minutes)
+    return value.hour * 60 + value.minute
 
-    return slots
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def slot_starts(start_time, end_time, duration_minutes=30):
+    """Start minute of every whole slot between start_time and end_time."""
+    return range(
+        to_minutes(start_time),
+        to_minutes(end_time) - duration_minutes + 1,
+        duration_minutes,
+    )
+
+
+def generate_time_slots(start_time, end_time, duration_minutes=30):
+    return [format_minutes(m) for m in slot_starts(start_time, end_time, duration_minutes)]
 
 # ---------------------------------
 # MODELS
@@ -418,11 +646,27 @@ class PlanPurchase(db.Model):
 
 class StripeEvent(db.Model):
     """
-    Stores processed Stripe event IDs to make webhook handling idempotent.
+    Raw Stripe webhook events. The unique event_id makes delivery
+    idempotent; the worker processes queued rows in order per object.
+    status: queued -> processing -> processed, or dead after
+    STRIPE_EVENT_MAX_ATTEMPTS failures (NULL for rows stored before the queue).
     """
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(db.String(255), unique=True, nullable=False)
+    event_type = db.Column(db.String(100), nullable=True)
+    object_id = db.Column(db.String(255), nullable=True, index=True)  # data.object.id
+    stripe_created = db.Column(db.Integer, nullable=True)  # event.created (unix time)
+    payload = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), default="queued")
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_stripe_event_status_order", "status", "stripe_created", "id"),
+    )
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     coach_id = db.Column(db.Integer, db.ForeignKey("coach.id"), nullable=False)
@@ -434,6 +678,74 @@ class Review(db.Model):
     # Relationship to access the student's name
     student = db.relationship("User", backref="reviews_written", lazy=True)
 
+    __table_args__ = (
+        # One-review-per-student check in add_review
+        db.Index("ix_review_coach_user", "coach_id", "user_id"),
+    )
+
+
+class OutboundEmail(db.Model):
+    """
+    Outbox row: routes enqueue mail here and the dispatcher sends it.
+    status: queued -> sending -> sent, or back to queued with a later
+    next_attempt_at on failure, until failed after EMAIL_MAX_ATTEMPTS.
+    """
+    __tablename__ = "outbound_email"
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # JSON list
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="queued", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    claim_token = db.Column(db.String(32), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_outbound_email_due", "status", "next_attempt_at"),
+    )
+
+
+class NewsletterJob(db.Model):
+    """
+    A bulk newsletter send. Subscribers are sent in id order and
+    last_subscriber_id records progress, so an interrupted job resumes
+    after the last completed chunk.
+    """
+    __tablename__ = "newsletter_job"
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)  # rendered once, sent to everyone
+    status = db.Column(db.String(20), default="queued")  # queued / running / done / failed
+    total_count = db.Column(db.Integer, default=0)
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    last_subscriber_id = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class Lead(db.Model):
+    """Contact-form lead, buffered here until the flusher appends it to Google Sheets."""
+    __tablename__ = "lead"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    phone = db.Column(db.String(15))
+    email = db.Column(db.String(120))
+    needs = db.Column(db.Text)
+    source = db.Column(db.String(50), default="contact_form")
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    synced_at = db.Column(db.DateTime, nullable=True, index=True)
+    claim_token = db.Column(db.String(32), nullable=True)  # flusher holding the lease
+    claimed_until = db.Column(db.DateTime, nullable=True)
+
 
 class Subscriber(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -471,42 +783,83 @@ class Coach(db.Model):
     # Sports & pricing
     sport = db.Column(db.String(500), nullable=False)
     sports_prices = db.Column(db.Text, default="{}")
-    price_per_session = db.Column(db.Integer, nullable=False)
+    price_per_session = db.Column(db.Integer, nullable=False, index=True)
 
     # Location
     pincode = db.Column(db.String(10))
     state = db.Column(db.String(100))
     city = db.Column(db.String(120), nullable=False)
+    city_key = db.Column(db.String(120), index=True)  # normalize_search_key(city)
     travel_radius = db.Column(db.Integer, default=0)
 
     # Profile
     experience_years = db.Column(db.Integer, default=0)
     rating = db.Column(db.Float, default=0.0)
+    # Review aggregates, maintained alongside Review writes (rating = rating_sum / review_count)
+    review_count = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, default=0)
     tagline = db.Column(db.String(255))
     specialties = db.Column(db.Text)
     age = db.Column(db.Integer)
     phone = db.Column(db.String(15))
     profile_image = db.Column(db.String(300), default="default_coach.jpg")
+    # Set once the resized variants of profile_image exist (see process_coach_image)
+    image_variants = db.Column(db.Boolean, default=False)
     achievements = db.Column(db.Text)
     is_verified = db.Column(db.Boolean, default=False)
 
+    # Precomputed on write (see refresh_profile_stats)
+    badge_label = db.Column(db.String(30), index=True)
+    profile_completion = db.Column(db.Integer, default=0, index=True)
+
+    # Bumped by every INSERT/UPDATE; max(updated_at) versions /api/coaches
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+
     # ✅ SOCIAL LINKS (DATABASE FIELDS ONLY)
     instagram_url = db.Column(db.String(255))
     youtube_url = db.Column(db.String(255))
     linkedin_url = db.Column(db.String(255))
     website_url = db.Column(db.String(255))
-    # Availability
+    # Legacy blocked-date blob, superseded by CoachBlockedDate
+    # (moved over and cleared by `flask --app app migrate-db`)
     availability_json = db.Column(db.Text, default="{}")
 
+    __table_args__ = (
+        # Directory ordering / keyset pagination: (rating desc, id desc)
+        db.Index("ix_coach_rating_id", "rating", "id"),
+    )
+
     # Relationships
     reviews = db.relationship(
         "Review", backref="coach", lazy=True, cascade="all, delete-orphan"
     )
     bookings_received = db.relationship("Booking", backref="coach", lazy=True)
+    sport_links = db.relationship(
+        "CoachSport", backref="coach", lazy=True, cascade="all, delete-orphan"
+    )
+    blocked_dates = db.relationship(
+        "CoachBlockedDate", backref="coach", lazy=True, cascade="all, delete-orphan"
+    )
 
     def get_sports_list(self):
         return self.sport.split(",") if self.sport else []
 
+    def sync_search_keys(self):
+        """Refresh city_key and the coach_sport rows from the city / sport strings."""
+        self.city_key = normalize_search_key(self.city)
+
+        wanted = {normalize_search_key(s) for s in self.get_sports_list()}
+        wanted.discard("")
+        current = {link.sport_key: link for link in self.sport_links}
+
+        for key, link in current.items():
+            if key not in wanted:
+                self.sport_links.remove(link)
+        for key in wanted - set(current):
+            self.sport_links.append(CoachSport(sport_key=key))
+
     def get_price_dict(self):
         try:
             return json.loads(self.sports_prices) if self.sports_prices else {}
@@ -514,9 +867,9 @@ class Coach(db.Model):
             return {}
 
     def calculate_rating(self):
-        if not self.reviews:
+        if not self.review_count:
             return 0.0
-        return round(sum(r.rating for r in self.reviews) / len(self.reviews), 1)
+        return round((self.rating_sum or 0) / self.review_count, 1)
 
     def is_paid(self):
         return bool(self.user and self.user.stripe_customer_id)
@@ -530,6 +883,14 @@ class Coach(db.Model):
         msg = f"Hi {self.name}, I saw your profile on GameChanger and I'm interested in training."
         return f"https://wa.me/{number}?text={msg.replace(' ', '%20')}"
     def completion_score(self):
+        return self.profile_completion or 0
+
+    def refresh_profile_stats(self):
+        """Recompute the stored badge_label and profile_completion."""
+        self.badge_label = compute_coach_badge(self)
+        self.profile_completion = self.calculate_completion_score()
+
+    def calculate_completion_score(self):
         score = 0
 
         # Profile basics
@@ -556,7 +917,7 @@ class Coach(db.Model):
             score += 15
 
         # ✅ Availability (mandatory)
-        if self.weekly_availability and len(self.weekly_availability) >= 1:
+        if any(a.is_active for a in self.weekly_availability):
             score += 15
 
         # Bio
@@ -566,6 +927,34 @@ class Coach(db.Model):
         return min(score, 100)
 
 
+class CoachSport(db.Model):
+    """One row per (coach, sport) so the directory can filter sports by index."""
+    __tablename__ = "coach_sport"
+
+    id = db.Column(db.Integer, primary_key=True)
+    coach_id = db.Column(db.Integer, db.ForeignKey("coach.id"), nullable=False)
+    sport_key = db.Column(db.String(100), nullable=False)  # normalize_search_key(sport)
+
+    __table_args__ = (
+        db.UniqueConstraint("coach_id", "sport_key", name="uq_coach_sport"),
+        db.Index("ix_coach_sport_sport_key", "sport_key", "coach_id"),
+    )
+
+
+class CoachBlockedDate(db.Model):
+    """A date the coach is unavailable; replaces Coach.availability_json."""
+    __tablename__ = "coach_blocked_date"
+
+    id = db.Column(db.Integer, primary_key=True)
+    coach_id = db.Column(db.Integer, db.ForeignKey("coach.id"), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+
+    __table_args__ = (
+        # Also serves (coach_id, date) point and range lookups
+        db.UniqueConstraint("coach_id", "date", name="uq_coach_blocked_date"),
+    )
+
+
 class CoachVenue(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     coach_id = db.Column(db.Integer, db.ForeignKey("coach.id"), nullable=False)
@@ -587,8 +976,12 @@ class Booking(db.Model):
     sport = db.Column(db.String(100), nullable=False)
     booking_date = db.Column(db.Date, nullable=False)
     booking_time = db.Column(db.String(20), nullable=False)
+    # Session span in minutes since midnight, [start_minute, end_minute)
+    start_minute = db.Column(db.Integer)
+    end_minute = db.Column(db.Integer)
     location = db.Column(db.String(255), nullable=True)
     message = db.Column(db.Text, nullable=True)
+    price = db.Column(db.Integer, nullable=True)  # INR charged for this session
     status = db.Column(db.String(20), default="Pending")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     locked_until = db.Column(db.DateTime, nullable=True)
@@ -599,6 +992,38 @@ class Booking(db.Model):
     payment_provider = db.Column(db.String(20), default="test")
     payment_status = db.Column(db.String(20), default="pending")
 
+    __table_args__ = (
+        # At most one slot-holding booking per (coach, date, time)
+        db.Index(
+            "uq_booking_active_slot",
+            "coach_id", "booking_date", "booking_time",
+            unique=True,
+            sqlite_where=db.text("status IN ('Confirmed', 'Payment Pending')"),
+            postgresql_where=db.text("status IN ('Confirmed', 'Payment Pending')"),
+        ),
+        # Slot lookups / double-booking checks (any status)
+        db.Index("ix_booking_coach_slot_status", "coach_id", "booking_date", "booking_time", "status"),
+        # Overlap checks: start_minute < :end AND end_minute > :start within a day
+        db.Index("ix_booking_coach_day_span", "coach_id", "booking_date", "start_minute", "end_minute"),
+        # My bookings, newest first
+        db.Index("ix_booking_user_date", "user_id", "booking_date"),
+        # Expired payment lock sweeps
+        db.Index("ix_booking_status_locked_until", "status", "locked_until"),
+    )
+
+
+@db.event.listens_for(Booking, "before_insert")
+def fill_booking_span(mapper, connection, target):
+    """Derive the minute span for bookings created with booking_time only."""
+    if target.start_minute is None and target.booking_time:
+        try:
+            target.start_minute = to_minutes(target.booking_time)
+        except ValueError:
+            return
+    if target.end_minute is None and target.start_minute is not None:
+        target.end_minute = target.start_minute + DEFAULT_SESSION_MINUTES
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -614,15 +1039,51 @@ def redirect_for_user(user: User):
     return redirect(url_for("home"))
 
 
+SLUG_ATTEMPTS = 5
+
+
 def create_slug(name, sport_str):
+    """
+    Next free slug for name + first sport: base, base-2, base-3, ...
+    The suffixes already taken are read with one prefix query.
+    """
     first_sport = sport_str.split(",")[0] if sport_str else "coach"
     base = slugify(f"{name}-{first_sport}")
-    slug = base
-    counter = 2
-    while Coach.query.filter_by(slug=slug).first():
-        slug = f"{base}-{counter}"
-        counter += 1
-    return slug
+    taken = db.session.scalars(
+        db.select(Coach.slug).where(
+            db.or_(Coach.slug == base, Coach.slug.like(f"{base}-%"))
+        )
+    ).all()
+
+    highest = 0
+    for slug in taken:
+        suffix = "1" if slug == base else slug[len(base) + 1:]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+
+    return base if highest == 0 else f"{base}-{highest + 1}"
+
+
+def insert_coach(coach, name, sport_str):
+    """
+    Insert a new coach under the next free slug. The unique constraint on
+    Coach.slug settles races with a concurrent signup: the loser re-reads
+    the taken suffixes and retries.
+    """
+    for attempt in range(SLUG_ATTEMPTS):
+        coach.slug = create_slug(name, sport_str)
+        db.session.add(coach)
+        try:
+            db.session.commit()
+            return
+        except IntegrityError:
+            db.session.rollback()
+            slug_taken = db.session.scalar(
+                db.select(Coach.id).where(Coach.slug == coach.slug)
+            )
+            if slug_taken is None or attempt == SLUG_ATTEMPTS - 1:
+                raise
+            logger.info(f"Slug {coach.slug} taken concurrently, retrying")
 
 class CoachAvailability(db.Model):
     __tablename__ = "coach_availability"
@@ -641,157 +1102,751 @@ class CoachAvailability(db.Model):
 
     is_active = db.Column(db.Boolean, default=True)
 
+    # JSON list of slot start minutes, rebuilt on every write (see store_slot_template)
+    slot_template = db.Column(db.Text)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     coach = db.relationship("Coach", backref="weekly_availability")
-def release_expired_locks():
-    expired = Booking.query.filter(
-        Booking.status == "Payment Pending",
-        Booking.locked_until < datetime.utcnow()
-    ).all()
 
-    for b in expired:
-        b.status = "Cancelled"
-        b.locked_until = None
+    __table_args__ = (
+        # A weekday's active windows for one coach
+        db.Index("ix_coach_availability_coach_day", "coach_id", "day_of_week", "is_active"),
+    )
 
-    if expired:
-        db.session.commit()
+    def slot_minutes(self):
+        """Sorted start minute of every slot in this window."""
+        if self.slot_template:
+            return parse_slot_template(self.slot_template)
+        return tuple(slot_starts(self.start_time, self.end_time, self.slot_duration_minutes))
 
-# ---------------------------------
-# ROUTES
-# ---------------------------------
-# ---------- PLANS ROUTE ----------
-@app.route("/plans/checkout/<int:coach_id>", methods=["POST"])
-@login_required
-def create_plan_checkout(coach_id):
-    coach = Coach.query.get_or_404(coach_id)
 
-    sport = (request.form.get("sport") or "").strip()
-    plan_name = (request.form.get("plan_name") or "").strip()
-    sessions_count = int(request.form.get("sessions_count") or 0)
-    price = int(request.form.get("price") or 0)  # e.g. 5999 (INR)
+@lru_cache(maxsize=1024)
+def parse_slot_template(slot_template):
+    # Windows repeat across coaches and days, so most lookups are cache hits
+    return tuple(json.loads(slot_template))
 
-    if not sport or sessions_count <= 0 or price <= 0:
-        flash("Invalid plan details.", "danger")
-        return redirect(url_for("coach_detail", slug=coach.slug))
 
-    # Create a pending plan purchase
-    plan = PlanPurchase(
-        user_id=current_user.id,
-        coach_id=coach.id,
-        sport=sport,
-        plan_name=plan_name,
-        sessions_count=sessions_count,
-        price=price,
-        status="Payment Pending",
+@db.event.listens_for(CoachAvailability, "before_insert")
+@db.event.listens_for(CoachAvailability, "before_update")
+def store_slot_template(mapper, connection, target):
+    target.slot_template = json.dumps(list(slot_starts(
+        target.start_time,
+        target.end_time,
+        target.slot_duration_minutes or DEFAULT_SESSION_MINUTES,
+    )))
+
+
+def active_booking_filter(now=None):
+    """
+    SQL predicate for bookings that hold a slot:
+    Confirmed, or Payment Pending with an unexpired payment lock.
+    """
+    now = now or datetime.utcnow()
+    return (Booking.status == "Confirmed") | (
+        (Booking.status == "Payment Pending") & (Booking.locked_until > now)
     )
-    db.session.add(plan)
-    db.session.commit()
 
-    try:
-        # Reuse Stripe logic similar to your booking checkout
-        checkout_session = stripe.checkout.Session.create(
-            mode="payment",
-            customer_email=current_user.email,
-            line_items=[{
-                "price_data": {
-                    "currency": "inr",
-                    "unit_amount": price * 100,  # stripe uses paise
-                    "product_data": {
-                        "name": f"{plan_name} with {coach.name}",
-                        "description": f"{sport} plan ({sessions_count} sessions)",
-                    },
-                },
-                "quantity": 1,
-            }],
-            metadata={
-                "type": "plan_purchase",
-                "plan_id": plan.id,
-                "coach_id": coach.id,
-            },
-            success_url = url_for("plan_success", plan_id=plan.id, _external=True) + "?paymentsuccess=1",
-            cancel_url=url_for("coach_detail", slug=coach.slug, _external=True) + "?paymentcancelled=1",
-        )
-        return redirect(checkout_session.url, code=303)
-    except Exception as e:
-        logger.exception("Stripe Error while creating plan checkout")
-        db.session.delete(plan)
-        db.session.commit()
-        flash("Error initializing payment. Please try again.", "danger")
-        return redirect(url_for("coach_detail", slug=coach.slug))
-@app.route("/plans/success/<int:plan_id>")
-@login_required
-def plan_success(plan_id):
-    plan = PlanPurchase.query.get_or_404(plan_id)
 
-    if plan.user_id != current_user.id:
-        flash("You are not allowed to view this plan.", "danger")
-        return redirect(url_for("home"))
+def get_booked_spans(coach_id, date_obj):
+    """(start_minute, end_minute) of every slot-holding booking for a coach on a date (one query)."""
+    rows = db.session.query(Booking.start_minute, Booking.end_minute).filter(
+        Booking.coach_id == coach_id,
+        Booking.booking_date == date_obj,
+        active_booking_filter(),
+    ).all()
+    return [(r.start_minute, r.end_minute) for r in rows]
 
-    if plan.status != "Active":
-        flash("Your payment is still being processed. Please check again in a minute.", "info")
 
-    return render_template("plan_success.html", plan=plan)
+def overlapping_bookings(coach_id, date_obj, start_minute, end_minute):
+    """Slot-holding bookings that overlap [start_minute, end_minute) on a date."""
+    return db.select(Booking.id).where(
+        Booking.coach_id == coach_id,
+        Booking.booking_date == date_obj,
+        Booking.start_minute < end_minute,
+        Booking.end_minute > start_minute,
+        active_booking_filter(),
+    )
 
-@app.route("/plans")
-def plans():
-    return render_template("pricing.html")
 
+def session_minutes(coach_id, date_obj, start_minute):
+    """Slot length of the availability window the session starts in."""
+    windows = CoachAvailability.query.filter_by(
+        coach_id=coach_id,
+        day_of_week=get_weekday(date_obj),
+        is_active=True
+    ).all()
+    for a in windows:
+        if to_minutes(a.start_time) <= start_minute < to_minutes(a.end_time):
+            return a.slot_duration_minutes or DEFAULT_SESSION_MINUTES
+    return DEFAULT_SESSION_MINUTES
+
+
+# ---------- LOADER PROFILES ----------
+# Named eager-loading option sets, one per page, so templates don't
+# lazy-load relationships row by row.
+LOADER_PROFILES = {
+    # coach_detail.html lists the coach's venues
+    "coach_detail": lambda: [db.selectinload(Coach.venues)],
+    # dashboard checklist reads venues and weekly availability
+    "coach_dashboard": lambda: [
+        db.selectinload(Coach.venues),
+        db.selectinload(Coach.weekly_availability),
+    ],
+    # booking rows show the student's name / image
+    "booking_with_student": lambda: [db.joinedload(Booking.student)],
+    # admin recent bookings show coach and student
+    "booking_admin": lambda: [
+        db.joinedload(Booking.coach),
+        db.joinedload(Booking.student),
+    ],
+}
 
-@app.route("/review/<int:coach_id>", methods=["POST"])
-@hirer_required
-def add_review(coach_id):
-    coach = Coach.query.get_or_404(coach_id)
 
-    valid_booking = Booking.query.filter_by(
-        user_id=current_user.id, coach_id=coach.id, status="Confirmed"
-    ).first()
+def loader_profile(name):
+    return LOADER_PROFILES[name]()
 
-    if not valid_booking:
-        flash(
-            "You must complete a session with this coach before leaving a review.",
-            "danger",
-        )
-        return redirect(url_for("coach_detail", slug=coach.slug))
 
-    rating_str = request.form.get("rating", "").strip()
-    comment = request.form.get("comment", "").strip()
+# Per-endpoint SQL statement budgets. A request that goes over logs a
+# warning, so an N+1 regression shows up in the logs.
+QUERY_BUDGETS = {
+    "coach_detail": 6,
+    "coach_dashboard": 12,
+    "coach_bookings": 6,
+    "admin_dashboard": 12,
+    "api_coaches": 2,
+}
 
-    # Validate rating
-    try:
-        rating = int(rating_str)
-    except (TypeError, ValueError):
-        flash("Please select a valid rating.", "danger")
-        return redirect(url_for("coach_detail", slug=coach.slug))
 
-    if rating < 1 or rating > 5:
-        flash("Rating must be between 1 and 5.", "danger")
-        return redirect(url_for("coach_detail", slug=coach.slug))
+@db.event.listens_for(db.Engine, "before_cursor_execute")
+def count_request_statements(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get("sql_statements", 0) + 1
 
-    # Validate comment length
-    if comment and len(comment) > 2000:
-        flash("Comment is too long (max 2000 characters).", "danger")
-        return redirect(url_for("coach_detail", slug=coach.slug))
 
-    existing_review = Review.query.filter_by(
-        coach_id=coach.id, user_id=current_user.id
-    ).first()
+@app.after_request
+def check_query_budget(response):
+    budget = QUERY_BUDGETS.get(request.endpoint)
+    used = g.get("sql_statements", 0)
+    if budget is not None and used > budget:
+        logger.warning(f"{request.endpoint} ran {used} SQL statements (budget {budget})")
+    return response
 
-    if existing_review:
-        existing_review.rating = rating
-        existing_review.comment = sanitize_input(comment, max_length=2000)
-    else:
-        new_review = Review(
-            coach_id=coach.id,
-            user_id=current_user.id,
+
+# ---------- PRECOMPUTED COACH STATS ----------
+# badge_label / profile_completion are refreshed whenever a coach, venue,
+# weekly availability or review row changes: flushes record the affected
+# coach ids, and the commit recomputes them before writing.
+COACH_STATS_PENDING = "coach_stats_pending"
+
+
+@db.event.listens_for(db.session, "after_flush")
+def track_coach_stats(session, flush_context):
+    pending = session.info.setdefault(COACH_STATS_PENDING, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Coach):
+            pending.add(obj.id)
+        elif isinstance(obj, (CoachVenue, CoachAvailability, Review)):
+            pending.add(obj.coach_id)
+
+
+@db.event.listens_for(db.session, "before_commit")
+def refresh_coach_stats(session):
+    session.flush()
+    pending = session.info.pop(COACH_STATS_PENDING, set())
+    for coach_id in pending:
+        coach = session.get(Coach, coach_id) if coach_id else None
+        if coach is None:
+            continue
+        session.expire(coach, ["venues", "weekly_availability"])
+        coach.refresh_profile_stats()
+
+
+@db.event.listens_for(db.session, "after_commit")
+@db.event.listens_for(db.session, "after_soft_rollback")
+def clear_coach_stats(session, *args):
+    session.info.pop(COACH_STATS_PENDING, None)
+
+
+# ---------- HOME FRAGMENT INVALIDATION ----------
+# Coach fields shown in (or ordering) the home page featured-coaches block
+HOME_FRAGMENT_FIELDS = ("rating", "is_verified", "name", "tagline", "price_per_session", "slug")
+HOME_FRAGMENT_STALE = "home_fragment_stale"
+
+
+@db.event.listens_for(db.session, "after_flush")
+def track_home_fragment(session, flush_context):
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Coach):
+            session.info[HOME_FRAGMENT_STALE] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, Coach):
+            state = db.inspect(obj)
+            if any(state.attrs[f].history.has_changes() for f in HOME_FRAGMENT_FIELDS):
+                session.info[HOME_FRAGMENT_STALE] = True
+                return
+
+
+@db.event.listens_for(db.session, "after_commit")
+def invalidate_home_fragment(session):
+    if session.info.pop(HOME_FRAGMENT_STALE, False):
+        cache.delete(HOME_CACHE_KEY)
+
+
+@db.event.listens_for(db.session, "after_soft_rollback")
+def discard_home_fragment_flag(session, previous_transaction):
+    session.info.pop(HOME_FRAGMENT_STALE, None)
+
+
+def release_expired_slot(coach_id, booking_date, booking_time):
+    """Cancel an expired Payment Pending booking holding this exact slot."""
+    result = db.session.execute(
+        db.update(Booking)
+        .where(
+            Booking.coach_id == coach_id,
+            Booking.booking_date == booking_date,
+            Booking.booking_time == booking_time,
+            Booking.status == "Payment Pending",
+            Booking.locked_until < datetime.utcnow(),
+        )
+        .values(status="Cancelled", locked_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim_slot(booking):
+    """
+    Insert a slot-holding booking. The uq_booking_active_slot partial
+    unique index decides races between workers: a conflicting INSERT
+    fails instead of double booking. If the current holder's payment lock
+    has expired, it is cancelled and the INSERT retried once.
+    Returns True if the booking now holds the slot.
+    """
+    for attempt in range(2):
+        db.session.add(booking)
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+
+        if attempt or not release_expired_slot(
+            booking.coach_id, booking.booking_date, booking.booking_time
+        ):
+            break
+
+    logger.info(
+        f"Slot conflict for coach {booking.coach_id} on "
+        f"{booking.booking_date} {booking.booking_time}"
+    )
+    return False
+
+
+# ---------- EMAIL OUTBOX DISPATCHER ----------
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "4"))
+EMAIL_DISPATCH_INTERVAL = int(os.getenv("EMAIL_DISPATCH_INTERVAL", "5"))
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_BACKOFF_SECONDS = 30  # doubles each attempt
+EMAIL_LEASE_MINUTES = 5  # a "sending" row is reclaimed after this
+EMAIL_BATCH = 50
+
+
+def enqueue_email(msg):
+    """Store a flask_mail Message in the outbox; the dispatcher sends it."""
+    db.session.add(OutboundEmail(
+        subject=msg.subject,
+        recipients=json.dumps(list(msg.recipients)),
+        body=msg.body or "",
+    ))
+    db.session.commit()
+
+
+def claim_due_emails(limit=EMAIL_BATCH):
+    """Lease up to `limit` due outbox rows to this dispatcher; returns their ids."""
+    now = datetime.utcnow()
+    due = (
+        OutboundEmail.status.in_(["queued", "sending"]),
+        OutboundEmail.next_attempt_at <= now,
+    )
+    ids = db.session.scalars(
+        db.select(OutboundEmail.id).where(*due).order_by(OutboundEmail.id).limit(limit)
+    ).all()
+    if not ids:
+        return []
+
+    token = os.urandom(16).hex()
+    db.session.execute(
+        db.update(OutboundEmail)
+        .where(OutboundEmail.id.in_(ids), *due)
+        .values(
+            status="sending",
+            claim_token=token,
+            next_attempt_at=now + timedelta(minutes=EMAIL_LEASE_MINUTES),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.scalars(
+        db.select(OutboundEmail.id).where(OutboundEmail.claim_token == token)
+    ).all()
+
+
+def deliver_email(email_id):
+    """Send one leased outbox row (runs on a worker thread). Returns True if sent."""
+    with app.app_context():
+        email = db.session.get(OutboundEmail, email_id)
+        if email is None or email.status != "sending":
+            return False
+        try:
+            msg = Message(email.subject, recipients=json.loads(email.recipients))
+            msg.body = email.body
+            mail.send(msg)
+        except Exception as e:
+            email.attempts += 1
+            email.last_error = str(e)[:1000]
+            if email.attempts >= EMAIL_MAX_ATTEMPTS:
+                email.status = "failed"
+                logger.error(f"Email {email.id} failed permanently: {e}")
+            else:
+                email.status = "queued"
+                email.next_attempt_at = datetime.utcnow() + timedelta(
+                    seconds=EMAIL_BACKOFF_SECONDS * 2 ** (email.attempts - 1)
+                )
+                logger.warning(f"Email {email.id} failed (attempt {email.attempts}): {e}")
+            db.session.commit()
+            return False
+
+        email.status = "sent"
+        email.sent_at = datetime.utcnow()
+        email.claim_token = None
+        db.session.commit()
+        return True
+
+
+def dispatch_pending_emails(executor):
+    """Send every due outbox row through the worker pool. Returns (sent, failed)."""
+    sent = failed = 0
+    while True:
+        ids = claim_due_emails()
+        if not ids:
+            break
+        for ok in executor.map(deliver_email, ids):
+            if ok:
+                sent += 1
+            else:
+                failed += 1
+    return sent, failed
+
+
+def run_email_dispatcher(interval):
+    with ThreadPoolExecutor(max_workers=EMAIL_WORKERS, thread_name_prefix="email") as executor:
+        while True:
+            with app.app_context():
+                try:
+                    sent, failed = dispatch_pending_emails(executor)
+                    if sent or failed:
+                        logger.info(f"Email dispatcher: {sent} sent, {failed} failed")
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Email dispatcher failed")
+            time_module.sleep(interval)
+
+
+def start_email_dispatcher(interval):
+    thread = threading.Thread(
+        target=run_email_dispatcher, args=(interval,), name="email-dispatcher", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+# ---------- EXPIRED PAYMENT LOCK SWEEPER ----------
+# Seconds between in-process sweeps; 0 disables the worker thread
+# (use `flask --app app sweep-locks` from cron instead).
+LOCK_SWEEP_INTERVAL = int(os.getenv("LOCK_SWEEP_INTERVAL", "0"))
+LOCK_SWEEP_BATCH = 500
+
+
+def release_expired_locks(batch_size=LOCK_SWEEP_BATCH):
+    """
+    Cancel expired Payment Pending bookings with bulk UPDATEs of at most
+    batch_size rows each. Returns the number of bookings released.
+    """
+    released = 0
+    while True:
+        now = datetime.utcnow()
+        expired = (
+            Booking.status == "Payment Pending",
+            Booking.locked_until < now,
+        )
+        ids = db.session.scalars(
+            db.select(Booking.id).where(*expired).order_by(Booking.id).limit(batch_size)
+        ).all()
+        if not ids:
+            break
+
+        # Re-check the predicate so a booking confirmed meanwhile is left alone
+        result = db.session.execute(
+            db.update(Booking)
+            .where(Booking.id.in_(ids), *expired)
+            .values(status="Cancelled", locked_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        released += result.rowcount
+
+        if len(ids) < batch_size:
+            break
+
+    return released
+
+
+def run_lock_sweeper(interval):
+    while True:
+        time_module.sleep(interval)
+        with app.app_context():
+            try:
+                released = release_expired_locks()
+                if released:
+                    logger.info(f"Lock sweeper released {released} expired payment locks")
+            except Exception:
+                db.session.rollback()
+                logger.exception("Lock sweeper failed")
+
+
+def start_lock_sweeper(interval):
+    thread = threading.Thread(
+        target=run_lock_sweeper, args=(interval,), name="lock-sweeper", daemon=True
+    )
+    thread.start()
+    return thread
+
+# ---------- COACH IMAGE VARIANTS ----------
+# Square WebP copies of each coach photo, sized for 2x displays:
+# thumb for list avatars, card for the dashboard, detail for the profile page.
+IMAGE_VARIANTS = {"thumb": 96, "card": 192, "detail": 320}
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+
+def save_coach_upload(file):
+    """Store an upload under a content-hashed name and return that name."""
+    data = file.read()
+    ext = file.filename.rsplit(".", 1)[1].lower()
+    filename = f"coach_{hashlib.sha256(data).hexdigest()[:16]}.{ext}"
+    path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    if not os.path.exists(path):
+        with open(path, "wb") as fh:
+            fh.write(data)
+    return filename
+
+
+def image_variant_name(filename, variant):
+    return f"{filename.rsplit('.', 1)[0]}_{variant}.webp"
+
+
+def write_image_variants(filename):
+    """
+    Write the resized variants of an uploaded photo. Pixels are re-encoded
+    from scratch, so EXIF/GPS and other metadata are not carried over.
+    """
+    folder = app.config["UPLOAD_FOLDER"]
+    targets = {
+        variant: os.path.join(folder, image_variant_name(filename, variant))
+        for variant in IMAGE_VARIANTS
+    }
+    if all(os.path.exists(path) for path in targets.values()):
+        return
+
+    with Image.open(os.path.join(folder, filename)) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        for variant, size in IMAGE_VARIANTS.items():
+            resized = ImageOps.fit(img, (size, size), Image.LANCZOS)
+            tmp_path = targets[variant] + ".tmp"
+            resized.save(tmp_path, "WEBP", quality=IMAGE_QUALITY, method=6)
+            os.replace(tmp_path, targets[variant])
+
+
+def process_coach_image(filename):
+    """Generate variants for a photo and flag every coach still using it."""
+    if not PIL_AVAILABLE or not filename or filename == "default_coach.jpg":
+        return 0
+    with app.app_context():
+        try:
+            write_image_variants(filename)
+            result = db.session.execute(
+                db.update(Coach)
+                .where(Coach.profile_image == filename)
+                .values(image_variants=True)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            return result.rowcount
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Image processing failed for {filename}")
+            return 0
+
+
+def queue_coach_image(filename):
+    """Resize a new upload on the image worker pool, off the request thread."""
+    if PIL_AVAILABLE and not app.testing:
+        image_executor.submit(process_coach_image, filename)
+
+
+@app.template_global()
+def coach_image_url(coach, variant="card"):
+    """Smallest suitable photo URL for a coach, falling back to the original upload."""
+    if not coach.profile_image:
+        return None
+    filename = coach.profile_image
+    if coach.image_variants:
+        filename = image_variant_name(filename, variant)
+    return url_for("static", filename="uploads/" + filename)
+
+# ---------- FINGERPRINTED STATIC ASSETS ----------
+# `flask --app app build-static` copies static files into static/build under
+# content-hashed names (with .gz/.br copies of text assets) and writes a
+# manifest. url_for("static", ...) then points at the hashed copy, served
+# with a one-year immutable Cache-Control. Without a manifest the plain
+# files are served as before.
+STATIC_BUILD_DIR = os.path.join(app.static_folder, "build")
+STATIC_MANIFEST_PATH = os.path.join(STATIC_BUILD_DIR, "manifest.json")
+STATIC_SKIP_DIRS = {"build", "uploads"}
+STATIC_COMPRESS_EXTENSIONS = {".css", ".js", ".svg", ".ico", ".json", ".txt"}
+STATIC_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+def load_static_manifest():
+    try:
+        with open(STATIC_MANIFEST_PATH) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+static_manifest = load_static_manifest()
+
+
+def build_static_assets():
+    """Write fingerprinted (and precompressed) copies of static files. Returns the manifest."""
+    shutil.rmtree(STATIC_BUILD_DIR, ignore_errors=True)
+    manifest = {}
+
+    for root, dirs, files in os.walk(app.static_folder):
+        if root == app.static_folder:
+            dirs[:] = [d for d in dirs if d not in STATIC_SKIP_DIRS]
+        for name in files:
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, app.static_folder).replace(os.sep, "/")
+            with open(source, "rb") as fh:
+                data = fh.read()
+
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            target = os.path.join(STATIC_BUILD_DIR, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as fh:
+                fh.write(data)
+
+            if ext.lower() in STATIC_COMPRESS_EXTENSIONS:
+                with open(target + ".gz", "wb") as fh:
+                    fh.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if BROTLI_AVAILABLE:
+                    with open(target + ".br", "wb") as fh:
+                        fh.write(brotli.compress(data, quality=11))
+
+            manifest[logical] = "build/" + hashed
+
+    with open(STATIC_MANIFEST_PATH, "w") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    return manifest
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == "static":
+        hashed = static_manifest.get(values.get("filename"))
+        if hashed:
+            values["filename"] = hashed
+
+
+@app.route("/static/build/<path:filename>")
+def static_build(filename):
+    """Serve a fingerprinted asset, preferring a precompressed copy."""
+    path = safe_join(STATIC_BUILD_DIR, filename)
+    if path is None:
+        abort(404)
+
+    served, encoding = filename, None
+    for name, suffix in STATIC_ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(path + suffix):
+            served, encoding = filename + suffix, name
+            break
+
+    response = send_from_directory(
+        STATIC_BUILD_DIR,
+        served,
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        max_age=STATIC_MAX_AGE,
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# ---------------------------------
+# ROUTES
+# ---------------------------------
+# ---------- PLANS ROUTE ----------
+@app.route("/plans/checkout/<int:coach_id>", methods=["POST"])
+@login_required
+def create_plan_checkout(coach_id):
+    coach = Coach.query.get_or_404(coach_id)
+
+    sport = (request.form.get("sport") or "").strip()
+    plan_name = (request.form.get("plan_name") or "").strip()
+    sessions_count = int(request.form.get("sessions_count") or 0)
+    price = int(request.form.get("price") or 0)  # e.g. 5999 (INR)
+
+    if not sport or sessions_count <= 0 or price <= 0:
+        flash("Invalid plan details.", "danger")
+        return redirect(url_for("coach_detail", slug=coach.slug))
+
+    # Create a pending plan purchase
+    plan = PlanPurchase(
+        user_id=current_user.id,
+        coach_id=coach.id,
+        sport=sport,
+        plan_name=plan_name,
+        sessions_count=sessions_count,
+        price=price,
+        status="Payment Pending",
+    )
+    db.session.add(plan)
+    db.session.commit()
+
+    try:
+        # Reuse Stripe logic similar to your booking checkout
+        checkout_session = stripe.checkout.Session.create(
+            mode="payment",
+            customer_email=current_user.email,
+            line_items=[{
+                "price_data": {
+                    "currency": "inr",
+                    "unit_amount": price * 100,  # stripe uses paise
+                    "product_data": {
+                        "name": f"{plan_name} with {coach.name}",
+                        "description": f"{sport} plan ({sessions_count} sessions)",
+                    },
+                },
+                "quantity": 1,
+            }],
+            metadata={
+                "type": "plan_purchase",
+                "plan_id": plan.id,
+                "coach_id": coach.id,
+            },
+            success_url = url_for("plan_success", plan_id=plan.id, _external=True) + "?paymentsuccess=1",
+            cancel_url=url_for("coach_detail", slug=coach.slug, _external=True) + "?paymentcancelled=1",
+        )
+        return redirect(checkout_session.url, code=303)
+    except Exception as e:
+        logger.exception("Stripe Error while creating plan checkout")
+        db.session.delete(plan)
+        db.session.commit()
+        flash("Error initializing payment. Please try again.", "danger")
+        return redirect(url_for("coach_detail", slug=coach.slug))
+@app.route("/plans/success/<int:plan_id>")
+@login_required
+def plan_success(plan_id):
+    plan = PlanPurchase.query.get_or_404(plan_id)
+
+    if plan.user_id != current_user.id:
+        flash("You are not allowed to view this plan.", "danger")
+        return redirect(url_for("home"))
+
+    if plan.status != "Active":
+        flash("Your payment is still being processed. Please check again in a minute.", "info")
+
+    return render_template("plan_success.html", plan=plan)
+
+@app.route("/plans")
+def plans():
+    return render_template("pricing.html")
+
+
+@app.route("/review/<int:coach_id>", methods=["POST"])
+@hirer_required
+def add_review(coach_id):
+    coach = Coach.query.get_or_404(coach_id)
+
+    valid_booking = Booking.query.filter_by(
+        user_id=current_user.id, coach_id=coach.id, status="Confirmed"
+    ).first()
+
+    if not valid_booking:
+        flash(
+            "You must complete a session with this coach before leaving a review.",
+            "danger",
+        )
+        return redirect(url_for("coach_detail", slug=coach.slug))
+
+    rating_str = request.form.get("rating", "").strip()
+    comment = request.form.get("comment", "").strip()
+
+    # Validate rating
+    try:
+        rating = int(rating_str)
+    except (TypeError, ValueError):
+        flash("Please select a valid rating.", "danger")
+        return redirect(url_for("coach_detail", slug=coach.slug))
+
+    if rating < 1 or rating > 5:
+        flash("Rating must be between 1 and 5.", "danger")
+        return redirect(url_for("coach_detail", slug=coach.slug))
+
+    # Validate comment length
+    if comment and len(comment) > 2000:
+        flash("Comment is too long (max 2000 characters).", "danger")
+        return redirect(url_for("coach_detail", slug=coach.slug))
+
+    # Lock the coach row so concurrent reviews can't lose an aggregate update
+    coach = (
+        Coach.query.filter_by(id=coach.id)
+        .with_for_update()
+        .populate_existing()
+        .one()
+    )
+
+    existing_review = Review.query.filter_by(
+        coach_id=coach.id, user_id=current_user.id
+    ).first()
+
+    if existing_review:
+        coach.rating_sum = (coach.rating_sum or 0) - existing_review.rating + rating
+        existing_review.rating = rating
+        existing_review.comment = sanitize_input(comment, max_length=2000)
+    else:
+        new_review = Review(
+            coach_id=coach.id,
+            user_id=current_user.id,
             rating=rating,
             comment=sanitize_input(comment, max_length=2000),
         )
         db.session.add(new_review)
+        coach.rating_sum = (coach.rating_sum or 0) + rating
+        coach.review_count = (coach.review_count or 0) + 1
 
-    db.session.commit()
-
-    # Calculate and update coach rating based on all reviews
+    # Update coach rating from the aggregates, in the same transaction
     coach.rating = coach.calculate_rating()
     db.session.commit()
 
@@ -833,7 +1888,7 @@ def subscribe():
                     + "\n\n"
                     "Best,\nThe GameChanger Team"
                 )
-                mail.send(msg)
+                enqueue_email(msg)
             except Exception as e:
                 logger.error(f"Email failed: {e}")
 
@@ -844,21 +1899,67 @@ def subscribe():
     return redirect(request.referrer or url_for("home"))
 
 
+# Seconds to cache the admin stats row; 0 disables the cache.
+ADMIN_STATS_TTL = int(os.getenv("ADMIN_STATS_TTL", "0"))
+ADMIN_STATS_CACHE_KEY = "admin:stats"
+
+
+def compute_admin_stats():
+    """
+    All admin dashboard numbers in one round trip. Revenue sums the booked
+    price of confirmed bookings (the coach's session price for bookings
+    made before Booking.price existed).
+    """
+    def count(column):
+        return db.select(db.func.count(column)).scalar_subquery()
+
+    revenue = (
+        db.select(
+            db.func.coalesce(
+                db.func.sum(db.func.coalesce(Booking.price, Coach.price_per_session)), 0
+            )
+        )
+        .select_from(Booking)
+        .join(Coach, Booking.coach_id == Coach.id)
+        .where(Booking.status == "Confirmed")
+        .scalar_subquery()
+    )
+
+    row = db.session.execute(
+        db.select(
+            count(User.id).label("total_users"),
+            count(Coach.id).label("total_coaches"),
+            count(Booking.id).label("total_bookings"),
+            count(Subscriber.id).label("subscribers"),
+            revenue.label("revenue"),
+        )
+    ).one()
+    return dict(row._mapping)
+
+
+def get_admin_stats():
+    if ADMIN_STATS_TTL <= 0:
+        return compute_admin_stats()
+
+    stats = cache.get(ADMIN_STATS_CACHE_KEY)
+    if stats is None:
+        stats = compute_admin_stats()
+        cache.set(ADMIN_STATS_CACHE_KEY, stats, ADMIN_STATS_TTL)
+    return stats
+
+
 @app.route("/admin")
 @admin_required
 def admin_dashboard():
 
-    stats = {
-        "total_users": User.query.count(),
-        "total_coaches": Coach.query.count(),
-        "total_bookings": Booking.query.count(),
-        "subscribers": Subscriber.query.count(),
-        "revenue": sum(
-            [b.coach.price_per_session for b in Booking.query.all() if b.coach]
-        ),
-    }
+    stats = get_admin_stats()
 
-    recent_bookings = Booking.query.order_by(Booking.created_at.desc()).limit(10).all()
+    recent_bookings = (
+        Booking.query.options(*loader_profile("booking_admin"))
+        .order_by(Booking.created_at.desc())
+        .limit(10)
+        .all()
+    )
     pending_coaches = Coach.query.filter_by(is_verified=False).limit(5).all()
 
     return render_template(
@@ -880,11 +1981,131 @@ def admin_verify_coach(coach_id):
     return redirect(url_for("admin_dashboard"))
 
 
+# ---------- BULK NEWSLETTER JOBS ----------
+NEWSLETTER_CHUNK = 500
+NEWSLETTER_CONNECTIONS = int(os.getenv("NEWSLETTER_CONNECTIONS", "4"))
+NEWSLETTER_STALE_MINUTES = 2  # a running job without a heartbeat this long can be resumed
+NEWSLETTER_HEARTBEAT_SECONDS = 15  # senders refresh heartbeat_at at least this often
+
+
+def claim_newsletter_job(job_id):
+    """Mark a job running if it is queued, failed or stalled. Returns True if claimed."""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        db.update(NewsletterJob)
+        .where(
+            NewsletterJob.id == job_id,
+            NewsletterJob.status.in_(["queued", "failed"]) | (
+                (NewsletterJob.status == "running") &
+                (NewsletterJob.heartbeat_at < now - timedelta(minutes=NEWSLETTER_STALE_MINUTES))
+            ),
+        )
+        .values(status="running", heartbeat_at=now, last_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def touch_newsletter_job(job_id):
+    """Refresh a running job's heartbeat so it isn't resumed as stalled."""
+    db.session.execute(
+        db.update(NewsletterJob)
+        .where(NewsletterJob.id == job_id, NewsletterJob.status == "running")
+        .values(heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def send_newsletter_batch(job_id, subject, body, emails):
+    """
+    Send one slice of a chunk over a single SMTP connection, refreshing the
+    job heartbeat while it goes: a slice can outlast NEWSLETTER_STALE_MINUTES
+    on a slow mail server. Returns (sent, failed).
+    """
+    sent = failed = 0
+    with app.app_context():
+        last_beat = time_module.monotonic()
+        with mail.connect() as conn:
+            for email in emails:
+                try:
+                    msg = Message(subject, recipients=[email])
+                    msg.body = body
+                    conn.send(msg)
+                    sent += 1
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"Newsletter send to {email} failed: {e}")
+                if time_module.monotonic() - last_beat >= NEWSLETTER_HEARTBEAT_SECONDS:
+                    touch_newsletter_job(job_id)
+                    last_beat = time_module.monotonic()
+    return sent, failed
+
+
+def run_newsletter_job(job_id):
+    """
+    Stream subscribers after last_subscriber_id in id-ordered chunks and
+    send each chunk over NEWSLETTER_CONNECTIONS parallel SMTP connections.
+    """
+    with app.app_context():
+        if not claim_newsletter_job(job_id):
+            return
+        job = db.session.get(NewsletterJob, job_id)
+        subject, body = job.subject, job.body
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=NEWSLETTER_CONNECTIONS, thread_name_prefix="newsletter"
+            ) as executor:
+                while True:
+                    chunk = db.session.execute(
+                        db.select(Subscriber.id, Subscriber.email)
+                        .where(Subscriber.id > job.last_subscriber_id)
+                        .order_by(Subscriber.id)
+                        .limit(NEWSLETTER_CHUNK)
+                    ).all()
+                    if not chunk:
+                        break
+
+                    emails = [row.email for row in chunk]
+                    slices = [emails[i::NEWSLETTER_CONNECTIONS] for i in range(NEWSLETTER_CONNECTIONS)]
+                    for sent, failed in executor.map(
+                        lambda batch: send_newsletter_batch(job_id, subject, body, batch),
+                        [batch for batch in slices if batch],
+                    ):
+                        job.sent_count += sent
+                        job.failed_count += failed
+
+                    job.last_subscriber_id = chunk[-1].id
+                    job.heartbeat_at = datetime.utcnow()
+                    db.session.commit()
+
+            job.status = "done"
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            logger.info(f"Newsletter job {job.id}: {job.sent_count} sent, {job.failed_count} failed")
+        except Exception as e:
+            db.session.rollback()
+            job.status = "failed"
+            job.last_error = str(e)[:1000]
+            db.session.commit()
+            logger.exception(f"Newsletter job {job_id} failed")
+
+
+def start_newsletter_job(job_id):
+    thread = threading.Thread(
+        target=run_newsletter_job, args=(job_id,), name=f"newsletter-{job_id}", daemon=True
+    )
+    thread.start()
+    return thread
+
+
 @app.route("/admin/email", methods=["GET", "POST"])
 @admin_required
 def admin_email():
 
-    subscribers = Subscriber.query.all()
+    subscriber_count = Subscriber.query.count()
 
     if request.method == "POST":
         subject = request.form.get("subject", "").strip()
@@ -893,45 +2114,71 @@ def admin_email():
         # Validate inputs
         if not subject:
             flash("Subject is required.", "warning")
-            return render_template("admin_email.html", subscriber_count=len(subscribers))
+            return render_template("admin_email.html", subscriber_count=subscriber_count)
         
         if len(subject) > 200:
             flash("Subject is too long (max 200 characters).", "warning")
-            return render_template("admin_email.html", subscriber_count=len(subscribers))
+            return render_template("admin_email.html", subscriber_count=subscriber_count)
 
         if not body_text:
             flash("Message is required.", "warning")
-            return render_template("admin_email.html", subscriber_count=len(subscribers))
+            return render_template("admin_email.html", subscriber_count=subscriber_count)
         
         if len(body_text) > 10000:
             flash("Message is too long (max 10000 characters).", "warning")
-            return render_template("admin_email.html", subscriber_count=len(subscribers))
-        else:
-            sent_count = 0
-            try:
-                subject_safe = sanitize_input(subject, max_length=200)
-                with mail.connect() as conn:
-                    for sub in subscribers:
-                        msg = Message(subject_safe, recipients=[sub.email])
-                        msg.body = sanitize_input(body_text, max_length=10000) + "\n\n--\nUnsubscribe: Reply with 'UNSUBSCRIBE'"
-                        conn.send(msg)
-                        sent_count += 1
-
-                flash(
-                    f"Successfully sent email to {sent_count} subscribers!",
-                    "success",
-                )
-                return redirect(url_for("admin_dashboard"))
+            return render_template("admin_email.html", subscriber_count=subscriber_count)
 
-            except Exception as e:
-                logger.error(f"Bulk email error: {e}")
-                flash("An error occurred while sending emails.", "danger")
+        job = NewsletterJob(
+            subject=str(sanitize_input(subject, max_length=200)),
+            body=str(sanitize_input(body_text, max_length=10000)) + "\n\n--\nUnsubscribe: Reply with 'UNSUBSCRIBE'",
+            total_count=subscriber_count,
+        )
+        db.session.add(job)
+        db.session.commit()
 
-    return render_template("admin_email.html", subscriber_count=len(subscribers))
+        start_newsletter_job(job.id)
+        flash(f"Newsletter queued for {subscriber_count} subscribers.", "success")
+        return redirect(url_for("admin_email_job", job_id=job.id))
 
+    return render_template("admin_email.html", subscriber_count=subscriber_count)
 
-@app.route("/")
-def home():
+
+@app.route("/admin/email/jobs/<int:job_id>")
+@admin_required
+def admin_email_job(job_id):
+    job = NewsletterJob.query.get_or_404(job_id)
+    stalled = job.status == "running" and job.heartbeat_at and (
+        job.heartbeat_at < datetime.utcnow() - timedelta(minutes=NEWSLETTER_STALE_MINUTES)
+    )
+
+    if request.args.get("format") == "json":
+        return jsonify({
+            "id": job.id,
+            "status": job.status,
+            "total": job.total_count,
+            "sent": job.sent_count,
+            "failed": job.failed_count,
+            "stalled": bool(stalled),
+        })
+
+    return render_template("admin_email_job.html", job=job, stalled=stalled)
+
+
+@app.route("/admin/email/jobs/<int:job_id>/resume", methods=["POST"])
+@admin_required
+def admin_email_job_resume(job_id):
+    NewsletterJob.query.get_or_404(job_id)
+    start_newsletter_job(job_id)
+    flash("Resuming newsletter send.", "info")
+    return redirect(url_for("admin_email_job", job_id=job_id))
+
+
+HOME_CACHE_TTL = int(os.getenv("HOME_CACHE_TTL", "60"))
+HOME_CACHE_KEY = "home:top_coaches"
+
+
+def build_home_fragment():
+    """Rendered featured-coaches block plus stats for the home page."""
     top_coaches = Coach.query.filter(Coach.rating > 0).order_by(Coach.rating.desc()).limit(6).all()
     if len(top_coaches) < 6:
         zero_rating_coaches = Coach.query.filter(Coach.rating == 0.0).limit(6 - len(top_coaches)).all()
@@ -1015,7 +2262,25 @@ def home():
                 self.__dict__.update(d)
         top_coaches = [_S(s) for s in sample]
 
-    return render_template("home.html", coaches=top_coaches,stats=stats, sports_list=SPORTS_LIST)
+    return {
+        "html": render_template("_home_coaches.html", coaches=top_coaches),
+        "stats": stats,
+    }
+
+
+@app.route("/")
+def home():
+    fragment = cache.get(HOME_CACHE_KEY)
+    if fragment is None:
+        fragment = build_home_fragment()
+        cache.set(HOME_CACHE_KEY, fragment, HOME_CACHE_TTL)
+
+    return render_template(
+        "home.html",
+        top_coaches_html=Markup(fragment["html"]),
+        stats=fragment["stats"],
+        sports_list=SPORTS_LIST,
+    )
 def send_plan_confirmation_emails(plan: PlanPurchase):
     student = User.query.get(plan.user_id)
     coach = Coach.query.get(plan.coach_id)
@@ -1034,7 +2299,7 @@ def send_plan_confirmation_emails(plan: PlanPurchase):
             "Your coach will contact you soon to schedule sessions.\n\n"
             "- GameChanger Team"
         )
-        mail.send(msg)
+        enqueue_email(msg)
 
     if coach and coach.user and coach.user.email:
         msg2 = Message(
@@ -1048,7 +2313,7 @@ def send_plan_confirmation_emails(plan: PlanPurchase):
             "You can now contact the student and plan the sessions.\n\n"
             "- GameChanger Team"
         )
-        mail.send(msg2)
+        enqueue_email(msg2)
 # ---------- STATIC INFO PAGES ----------
 @app.route("/about")
 def about():
@@ -1065,62 +2330,206 @@ def help_center():
 @app.route("/terms")
 def terms():
     return render_template("terms.html")
-@app.route("/coaches")
-def coaches():
-    # Pagination
-    page = request.args.get("page", 1, type=int)
+COACHES_PER_PAGE = 9
 
-    # Filters
-    sport_filter = request.args.get("sport", "").strip()
-    city_filter = request.args.get("city", "").strip()
-    price_min = request.args.get("price_min", type=int)
-    price_max = request.args.get("price_max", type=int)
 
+def read_coach_filters():
+    """Directory filters from the query string."""
+    return {
+        "sport_filter": request.args.get("sport", "").strip(),
+        "city_filter": request.args.get("city", "").strip(),
+        "price_min": request.args.get("price_min", type=int),
+        "price_max": request.args.get("price_max", type=int),
+    }
+
+
+def coach_filter_args(filters):
+    """The filters that were actually supplied, as query args for page links."""
+    args = {
+        "sport": filters["sport_filter"],
+        "city": filters["city_filter"],
+        "price_min": filters["price_min"],
+        "price_max": filters["price_max"],
+    }
+    return {name: value for name, value in args.items() if value not in (None, "")}
+
+
+def filter_coaches_query(sport_filter, city_filter, price_min, price_max):
+    """Coach query with the directory filters applied (no ordering)."""
     query = Coach.query
 
     if sport_filter:
-        query = query.filter(Coach.sport.ilike(f"%{sport_filter}%"))
+        query = query.join(CoachSport).filter(
+            CoachSport.sport_key == normalize_search_key(sport_filter)
+        )
     if city_filter:
-        query = query.filter(Coach.city.ilike(f"%{city_filter}%"))
+        query = query.filter(Coach.city_key == normalize_search_key(city_filter))
     if price_min is not None:
         query = query.filter(Coach.price_per_session >= price_min)
     if price_max is not None:
         query = query.filter(Coach.price_per_session <= price_max)
 
-    # Order by best rating first
-    pagination = query.order_by(Coach.rating.desc()).paginate(
-        page=page, per_page=9, error_out=False
-    )
+    return query
 
-    coaches = pagination.items  # <-- actual list used in template
 
-    # Derive badge_label in real-time for each coach
-    for coach in coaches:
-        if coach.is_verified:
-            # Verified gets at least Standard
-            if (coach.rating or 0) >= 4.7 and (coach.experience_years or 0) >= 5:
-                coach.badge_label = "Elite Coach"
-            elif (coach.rating or 0) >= 4.3 and (coach.experience_years or 0) >= 2:
-                coach.badge_label = "Premium Coach"
-            else:
-                coach.badge_label = "Standard Coach"
-        else:
-            # Not verified but experienced
-            if (coach.rating or 0) >= 4.5 and (coach.experience_years or 0) >= 3:
-                coach.badge_label = "Trusted Coach"
-            else:
-                coach.badge_label = None  # no badge
+def encode_coach_cursor(coach):
+    return f"{coach.rating or 0.0}:{coach.id}"
+
+
+def decode_coach_cursor(cursor):
+    """Return (rating, id) from a cursor string, or None for the first page."""
+    try:
+        rating, coach_id = cursor.split(":", 1)
+        return float(rating), int(coach_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def coach_keyset_page(query, cursor, per_page=COACHES_PER_PAGE):
+    """
+    Keyset page ordered by (rating desc, id desc): no OFFSET, no COUNT(*).
+    Returns (coaches, next_cursor); next_cursor is None on the last page.
+    """
+    position = decode_coach_cursor(cursor)
+    if position:
+        rating, last_id = position
+        query = query.filter(
+            (Coach.rating < rating) |
+            ((Coach.rating == rating) & (Coach.id < last_id))
+        )
+
+    rows = query.order_by(Coach.rating.desc(), Coach.id.desc()).limit(per_page + 1).all()
+    if len(rows) > per_page:
+        return rows[:per_page], encode_coach_cursor(rows[per_page - 1])
+    return rows, None
+
+
+@app.route("/coaches")
+def coaches():
+    filters = read_coach_filters()
+    query = filter_coaches_query(**filters)
+
+    # Keyset pages (?cursor=) skip OFFSET + COUNT. ?page= still serves the
+    # old numbered pages so existing links and bookmarks keep working.
+    page = request.args.get("page", type=int)
+    if page is None:
+        pagination = None
+        coaches, next_cursor = coach_keyset_page(query, request.args.get("cursor", ""))
+    else:
+        # Order by best rating first
+        pagination = query.order_by(Coach.rating.desc(), Coach.id.desc()).paginate(
+            page=page, per_page=COACHES_PER_PAGE, error_out=False
+        )
+        coaches = pagination.items  # <-- actual list used in template
+        next_cursor = None
 
     return render_template(
         "coaches.html",
         pagination=pagination,
+        next_cursor=next_cursor,
         coaches=coaches,          # only once
         sports_list=SPORTS_LIST,
-        sport_filter=sport_filter,
-        city_filter=city_filter,
-        price_min=price_min,
-        price_max=price_max,
+        filter_args=coach_filter_args(filters),
+        **filters,
     )
+
+
+@app.route("/api/coaches/feed")
+def coach_feed():
+    """Infinite-scroll variant of /coaches: rendered cards plus the next page URL."""
+    filters = read_coach_filters()
+    coaches, next_cursor = coach_keyset_page(
+        filter_coaches_query(**filters), request.args.get("cursor", "")
+    )
+    next_url = None
+    if next_cursor:
+        next_url = url_for("coach_feed", cursor=next_cursor, **coach_filter_args(filters))
+
+    html = "".join(
+        render_template("_coach_card.html", coach=coach) for coach in coaches
+    )
+    return jsonify({"html": html, "next_cursor": next_cursor, "next_url": next_url})
+
+
+# Columns /api/coaches may return; ?fields= picks a subset
+API_COACH_FIELDS = {
+    "id": Coach.id,
+    "slug": Coach.slug,
+    "name": Coach.name,
+    "sport": Coach.sport,
+    "city": Coach.city,
+    "state": Coach.state,
+    "price_per_session": Coach.price_per_session,
+    "rating": Coach.rating,
+    "review_count": Coach.review_count,
+    "experience_years": Coach.experience_years,
+    "tagline": Coach.tagline,
+    "is_verified": Coach.is_verified,
+    "badge_label": Coach.badge_label,
+    "profile_image": Coach.profile_image,
+}
+API_COACH_DEFAULT_FIELDS = (
+    "id", "slug", "name", "sport", "city", "price_per_session", "rating", "badge_label",
+)
+
+
+def coach_directory_version():
+    """Cheap change stamp for the directory: one indexed MAX(updated_at)."""
+    stamp = db.session.scalar(db.select(db.func.max(Coach.updated_at)))
+    return stamp.isoformat() if stamp else "empty"
+
+
+@app.route("/api/coaches")
+def api_coaches():
+    """
+    JSON directory with the /coaches filters, keyset pagination (?cursor=)
+    and a ?fields= projection. The ETag comes from the directory version
+    stamp and the query string, so If-None-Match polls get a 304 without
+    running the listing query.
+    """
+    requested = request.args.get("fields", "")
+    fields = [f.strip() for f in requested.split(",") if f.strip()] or list(API_COACH_DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in API_COACH_FIELDS]
+    if unknown:
+        return jsonify({
+            "error": f"Unknown fields: {', '.join(unknown)}",
+            "allowed": sorted(API_COACH_FIELDS),
+        }), 400
+
+    query_key = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    etag = hashlib.sha1(f"{coach_directory_version()}|{query_key}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        # id and rating are always selected: the keyset cursor needs them
+        selected = fields + [f for f in ("id", "rating") if f not in fields]
+        columns = [API_COACH_FIELDS[f] for f in selected]
+
+        filters = read_coach_filters()
+        rows, next_cursor = coach_keyset_page(
+            filter_coaches_query(**filters).with_entities(*columns),
+            request.args.get("cursor", ""),
+        )
+        next_url = None
+        if next_cursor:
+            next_url = url_for(
+                "api_coaches",
+                cursor=next_cursor,
+                fields=requested or None,
+                **coach_filter_args(filters),
+            )
+
+        response = jsonify({
+            "coaches": [{f: getattr(row, f) for f in fields} for row in rows],
+            "next_cursor": next_cursor,
+            "next_url": next_url,
+        })
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route("/coach/availability")
 @coach_required
 def coach_availability():
@@ -1138,16 +2547,71 @@ def coach_availability():
             "end": r.end_time.strftime("%H:%M"),
         }
 
-    blocked = {}
-    if coach.availability_json:
-        blocked = json.loads(coach.availability_json)
+    blocked = sorted(get_blocked_dates(coach.id, datetime.now().date()))
 
     return render_template(
         "coach_availability.html",
         weekly=weekly,
-        blocked=blocked,
+        blocked=[d.strftime("%Y-%m-%d") for d in blocked],
     )
 
+def apply_weekly_availability(coach_id, windows):
+    """
+    Diff the submitted week ({day_of_week: (start_time, end_time)}) against
+    the coach's CoachAvailability rows and touch only the days that changed:
+    new days are inserted, changed windows updated in place and dropped days
+    deactivated. Row ids stay stable and untouched rows keep their slot
+    templates. Returns {"added": [...], "updated": [...], "removed": [...]}
+    as day numbers; the caller commits.
+    """
+    rows = {}
+    extras = []
+    for row in CoachAvailability.query.filter_by(coach_id=coach_id).order_by(CoachAvailability.id):
+        if row.day_of_week in rows:
+            extras.append(row)
+        else:
+            rows[row.day_of_week] = row
+
+    changes = {"added": [], "updated": [], "removed": []}
+
+    # The form edits one window per day; older duplicate rows are retired
+    for row in extras:
+        if row.is_active:
+            row.is_active = False
+            if row.day_of_week not in changes["updated"]:
+                changes["updated"].append(row.day_of_week)
+
+    for day in range(7):
+        row = rows.get(day)
+        window = windows.get(day)
+
+        if window is None:
+            if row is not None and row.is_active:
+                row.is_active = False
+                changes["removed"].append(day)
+            continue
+
+        start, end = window
+        if row is None:
+            db.session.add(CoachAvailability(
+                coach_id=coach_id,
+                day_of_week=day,
+                start_time=start,
+                end_time=end,
+                slot_duration_minutes=30,
+                is_active=True,
+            ))
+            changes["added"].append(day)
+        elif (row.start_time, row.end_time, row.is_active) != (start, end, True):
+            was_active = row.is_active
+            row.start_time = start
+            row.end_time = end
+            row.is_active = True
+            changes["added" if not was_active else "updated"].append(day)
+
+    return changes
+
+
 @app.route("/coach/availability/update", methods=["POST"])
 @coach_required
 def update_availability():
@@ -1169,9 +2633,7 @@ def update_availability():
         "Sunday": 6,
     }
 
-    # Clear existing weekly availability
-    CoachAvailability.query.filter_by(coach_id=coach.id).delete()
-
+    windows = {}
     for day_name, day_num in days_map.items():
         active = request.form.get(f"day_{day_name}_active")
         start = request.form.get(f"day_{day_name}_start")
@@ -1184,30 +2646,50 @@ def update_availability():
         if start >= end:
             continue
 
-        availability = CoachAvailability(
-            coach_id=coach.id,
-            day_of_week=day_num,
-            start_time=datetime.strptime(start, "%H:%M").time(),
-            end_time=datetime.strptime(end, "%H:%M").time(),
-            slot_duration_minutes=30,
-            is_active=True,
+        windows[day_num] = (
+            datetime.strptime(start, "%H:%M").time(),
+            datetime.strptime(end, "%H:%M").time(),
         )
-        db.session.add(availability)
+
+    changes = apply_weekly_availability(coach.id, windows)
 
     # -------------------------------
     # 2. SAVE BLOCKED DATES
     # -------------------------------
+    # The form lists upcoming dates only; past rows are left as history.
     blocked_str = (request.form.get("blocked_dates") or "").strip()
-    blocked_dates = [d.strip() for d in blocked_str.split(",") if d.strip()]
-
-    availability_json = {}
-    for d in blocked_dates:
-        availability_json[d] = {"blocked": True}
+    wanted = set()
+    for d in blocked_str.split(","):
+        try:
+            wanted.add(datetime.strptime(d.strip(), "%Y-%m-%d").date())
+        except ValueError:
+            continue
 
-    coach.availability_json = json.dumps(availability_json)
+    today = datetime.now().date()
+    existing = get_blocked_dates(coach.id, today)
+    removed = existing - wanted
+    if removed:
+        CoachBlockedDate.query.filter(
+            CoachBlockedDate.coach_id == coach.id,
+            CoachBlockedDate.date.in_(removed),
+        ).delete(synchronize_session=False)
+    for d in sorted(wanted - existing):
+        if d >= today:
+            db.session.add(CoachBlockedDate(coach_id=coach.id, date=d))
 
     db.session.commit()
-    flash("Availability schedule updated successfully!", "success")
+
+    day_names = {num: name for name, num in days_map.items()}
+    summary = [
+        f"{label} {', '.join(day_names[d] for d in sorted(changes[key]))}"
+        for key, label in (("added", "added"), ("updated", "changed"), ("removed", "removed"))
+        if changes[key]
+    ]
+    if summary:
+        logger.info(f"Coach {coach.id} weekly availability: {'; '.join(summary)}")
+        flash(f"Availability updated: {'; '.join(summary)}.", "success")
+    else:
+        flash("Availability saved. Your weekly schedule is unchanged.", "success")
     return redirect(url_for("coach_availability"))
 
 
@@ -1227,7 +2709,9 @@ def delete_weekly_availability(availability_id):
 
 @app.route("/coaches/<slug>")
 def coach_detail(slug):
-    coach = Coach.query.filter_by(slug=slug).first_or_404()
+    coach = Coach.query.options(*loader_profile("coach_detail")).filter_by(
+        slug=slug
+    ).first_or_404()
     achievements = coach.achievements.splitlines() if coach.achievements else []
     specialties = [s.strip() for s in (coach.specialties or "").split(",") if s.strip()]
 
@@ -1331,15 +2815,7 @@ def book_session(coach_id):
     date_obj = date_result
 
     # Blocked date check
-    availability = {}
-    if coach.availability_json:
-        try:
-            availability = json.loads(coach.availability_json)
-        except Exception:
-            availability = {}
-
-    date_key = date_obj.strftime("%Y-%m-%d")
-    if date_key in availability and availability[date_key].get("blocked"):
+    if is_date_blocked(coach.id, date_obj):
         flash("Coach is unavailable on this date. Please choose another day.", "danger")
         return redirect(url_for("coach_detail", slug=coach.slug))
 
@@ -1347,30 +2823,23 @@ def book_session(coach_id):
     if not time_valid:
         flash(time_result, "danger")
         return redirect(url_for("coach_detail", slug=coach.slug))
+    start_minute = to_minutes(time_result)
+    end_minute = start_minute + session_minutes(coach.id, date_obj, start_minute)
+
+    # uq_booking_active_slot only catches the same start time; a session
+    # starting inside another one is found by the span overlap check.
+    if db.session.scalar(
+        overlapping_bookings(coach.id, date_obj, start_minute, end_minute).limit(1)
+    ) is not None:
+        flash("This time slot is already booked. Please choose another.", "danger")
+        return redirect(url_for("coach_detail", slug=coach.slug))
 
     # Validate message length
     if message and len(message) > 1000:
         flash("Message is too long (max 1000 characters).", "danger")
         return redirect(url_for("coach_detail", slug=coach.slug))
 
-    # --- 5. Check for Double Booking ---
-    existing_booking = Booking.query.filter_by(
-        coach_id=coach.id,
-        booking_date=date_obj,
-        booking_time=time_slot
-    ).filter(
-        (Booking.status == "Confirmed") |
-        (
-            (Booking.status == "Payment Pending") &
-            (Booking.locked_until > datetime.utcnow())
-        )
-    ).first()
-
-    if existing_booking:
-        flash("This time slot is already booked. Please choose another.", "danger")
-        return redirect(url_for("coach_detail", slug=coach.slug))
-
-    # --- 6. Create Booking Record ---
+    # --- 5. Create Booking Record ---
     lock_until = datetime.utcnow() + timedelta(minutes=PAYMENT_LOCK_MINUTES)
     initial_status = "Payment Pending"
 
@@ -1384,19 +2853,23 @@ def book_session(coach_id):
         user_id=current_user.id,
         sport=sanitize_input(sport),
         booking_date=date_obj,
-        booking_time=time_result,
+        booking_time=format_minutes(start_minute),
+        start_minute=start_minute,
+        end_minute=end_minute,
         venue_type=venue_type,
         student_address=sanitize_input(student_address, max_length=500),
         location=sanitize_input(location, max_length=255),
         message=sanitize_input(message, max_length=1000),
+        price=price_per_session,
         locked_until=lock_until,
         payment_mode=payment_mode,
         status="Pending" if payment_mode != "online" else "Payment Pending",
     )
 
-
-    db.session.add(new_booking)
-    db.session.commit()
+    # --- 6. Claim the slot (the INSERT itself detects double booking) ---
+    if not claim_slot(new_booking):
+        flash("This time slot is already booked. Please choose another.", "danger")
+        return redirect(url_for("coach_detail", slug=coach.slug))
 
     # --- 7. Handle Payment / Completion ---
     
@@ -1478,7 +2951,13 @@ def update_booking_status(booking_id):
         return redirect(url_for("coach_dashboard"))
 
     booking.status = new_status
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Re-confirming a booking whose slot someone else now holds.
+        db.session.rollback()
+        flash("That slot is already booked.", "danger")
+        return redirect(url_for("coach_dashboard"))
 
     try:
         if booking.student and booking.student.email:
@@ -1510,7 +2989,7 @@ def update_booking_status(booking_id):
 
             msg = Message(subject, recipients=[booking.student.email])
             msg.body = body
-            mail.send(msg)
+            enqueue_email(msg)
     except Exception as e:
         logger.error(f"Hirer notification email error: {e}")
 
@@ -1649,9 +3128,9 @@ def forgot_password():
                 "If you did not request this, you can safely ignore this email.\n\n"
                 "- GameChanger Team"
             )
-            mail.send(msg)
+            enqueue_email(msg)
             flash("If this email is registered, a reset link has been sent.", "info")
-            logger.info(f"Sent password reset email to user {user.id}")
+            logger.info(f"Queued password reset email to user {user.id}")
         except Exception as e:
             logger.error(f"Password reset email error: {e}")
             flash("Could not send reset email. Please try again later.", "danger")
@@ -1716,7 +3195,7 @@ def send_otp():
             f"Your Verification OTP is: {otp}\n\n"
             "Do not share this with anyone."
         )
-        mail.send(msg)
+        enqueue_email(msg)
         return {"status": "success", "message": "OTP sent to " + current_user.email}
     except Exception as e:
         logger.error(f"OTP email error: {e}")
@@ -1745,7 +3224,9 @@ def verify_coach():
 @app.route("/dashboard", methods=["GET", "POST"])
 @login_required
 def coach_dashboard():
-    coach = current_user.coach_profile
+    coach = Coach.query.options(*loader_profile("coach_dashboard")).filter_by(
+        user_id=current_user.id
+    ).first()
 
     # --- 1. HANDLE POST REQUEST (PROFILE UPDATE) ---
     if request.method == "POST":
@@ -1808,23 +3289,21 @@ def coach_dashboard():
                 if file and file.filename != "":
                     file_valid, file_msg = validate_file_upload(file)
                     if file_valid:
-                        ext = file.filename.rsplit(".", 1)[1].lower()
-                        new_filename = secure_filename(
-                            f"coach_{current_user.id}_{int(datetime.now().timestamp())}.{ext}"
-                        )
-                        file.save(os.path.join(app.config["UPLOAD_FOLDER"], new_filename))
-                        image_filename = new_filename
+                        image_filename = save_coach_upload(file)
                     else:
                         flash(file_msg, "danger")
                         valid = False
 
         if valid:
+            needs_variants = (
+                coach is None
+                or coach.profile_image != image_filename
+                or not coach.image_variants
+            )
             if coach is None:
                 # Create new profile
-                slug = create_slug(name, sports_str)
                 coach = Coach(
                     user_id=current_user.id,
-                    slug=slug,
                     name=sanitize_input(name),
                     sport=sports_str,
                     sports_prices=prices_json,
@@ -1846,7 +3325,8 @@ def coach_dashboard():
                     linkedin_url=sanitize_input(linkedin_url, max_length=255),
                     website_url=sanitize_input(website_url, max_length=255),
                     )
-                db.session.add(coach)
+                coach.sync_search_keys()
+                insert_coach(coach, name, sports_str)
             else:
                 # Update existing profile
                 coach.name = sanitize_input(name)
@@ -1861,6 +3341,8 @@ def coach_dashboard():
                 coach.phone = sanitize_input(phone)
                 coach.tagline = sanitize_input(tagline)
                 coach.specialties = sanitize_input(specialties)
+                if coach.profile_image != image_filename:
+                    coach.image_variants = False
                 coach.profile_image = image_filename
                 coach.achievements = sanitize_input(achievements)
                 coach.travel_radius = travel_radius
@@ -1868,8 +3350,11 @@ def coach_dashboard():
                 coach.youtube_url = sanitize_input(youtube_url, max_length=255)
                 coach.linkedin_url = sanitize_input(linkedin_url, max_length=255)
                 coach.website_url = sanitize_input(website_url, max_length=255)
+                coach.sync_search_keys()
+                db.session.commit()
 
-            db.session.commit()
+            if needs_variants:
+                queue_coach_image(image_filename)
             flash("Profile updated successfully!", "success")
             return redirect(url_for("coach_dashboard"))
     # --- 2. PREPARE DATA FOR TEMPLATE (GET Request) ---
@@ -1894,7 +3379,9 @@ def coach_dashboard():
     # Coach Bookings (Bookings received from students)
     received_bookings = []
     if coach:
-        received_query = Booking.query.filter_by(coach_id=coach.id)
+        received_query = Booking.query.options(
+            *loader_profile("booking_with_student")
+        ).filter_by(coach_id=coach.id)
         received_query = apply_booking_filter(received_query)
         received_bookings = received_query.order_by(Booking.booking_date.desc()).all()
 
@@ -1908,7 +3395,7 @@ def coach_dashboard():
         stats['total_bookings'] = Booking.query.filter_by(coach_id=coach.id).count()
         stats['confirmed_bookings'] = Booking.query.filter_by(coach_id=coach.id, status='Confirmed').count()
         stats['pending_bookings'] = Booking.query.filter_by(coach_id=coach.id, status='Pending').count()
-        stats['total_reviews'] = Review.query.filter_by(coach_id=coach.id).count()
+        stats['total_reviews'] = coach.review_count or 0
         stats['rating'] = coach.rating
     else:
         # Fallback stats for hirer only
@@ -1945,7 +3432,9 @@ def coach_bookings():
 
     received_bookings = []
     if coach:
-        q = Booking.query.filter_by(coach_id=coach.id)
+        q = Booking.query.options(
+            *loader_profile("booking_with_student")
+        ).filter_by(coach_id=coach.id)
         received_bookings = apply_booking_filter(q).order_by(
             Booking.booking_date.desc()
         ).all()
@@ -2027,7 +3516,7 @@ def create_checkout_session(plan):
         return redirect(url_for("plans"))
 @app.route("/stripe_webhook", methods=["POST"])
 def stripe_webhook():
-    """Webhook endpoint for Stripe events. Verifies signature and performs idempotent handling."""
+    """Webhook endpoint for Stripe events. Verifies the signature and queues the event."""
     payload = request.get_data(as_text=True)
     sig_header = request.headers.get("Stripe-Signature", None)
 
@@ -2051,65 +3540,264 @@ def stripe_webhook():
         logger.exception("Unexpected error while verifying webhook")
         return ("Webhook verification error", 400)
 
-    event_id = event.get("id")
-    if StripeEvent.query.filter_by(event_id=event_id).first():
-        logger.info(f"Webhook event {event_id} already processed — skipping.")
-        return ("Already processed", 200)
+    # Store the raw event and acknowledge; the worker does the processing.
+    # The unique event_id turns Stripe's retries into no-ops.
+    event_id = event.get("id")
+    data_object = (event.get("data") or {}).get("object") or {}
+    try:
+        db.session.add(StripeEvent(
+            event_id=event_id,
+            event_type=event.get("type"),
+            object_id=data_object.get("id"),
+            stripe_created=event.get("created"),
+            payload=payload,
+        ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        logger.info(f"Webhook event {event_id} already received — skipping.")
+        return ("Already received", 200)
+    except Exception:
+        db.session.rollback()
+        logger.exception("Could not store StripeEvent; Stripe will retry.")
+        return ("DB error", 500)
+
+    stripe_events_wakeup.set()
+    return ("OK", 200)
+
+
+def handle_stripe_event(event):
+    """Apply one Stripe event. Must stay idempotent: events can be replayed."""
+    if event["type"] != "checkout.session.completed":
+        return
+
+    session_obj = event["data"]["object"]
+    metadata = session_obj.get("metadata", {}) or {}
+
+    # 1) Generic subscription / plan purchases (no metadata["type"])
+    if metadata.get("type") is None:
+        client_ref = session_obj.get("client_reference_id")
+        customer_id = session_obj.get("customer")
+        if client_ref:
+            user = User.query.get(int(client_ref))
+            if user:
+                user.stripe_customer_id = customer_id
+                user.stripe_session_id = session_obj.get("id")
+                db.session.commit()
+
+    # 2) Single coach booking
+    elif metadata.get("type") == "coach_booking":
+        booking_id = metadata.get("booking_id")
+        if booking_id:
+            booking = Booking.query.get(booking_id)
+            payment_intent = session_obj.get("payment_intent")
+            # A paid booking that lost its slot (rejected, or its slot was
+            # re-booked after the payment lock ran out) is flagged for a
+            # refund, so the event completes instead of retrying forever.
+            if booking and booking.status == "Confirmed":
+                pass
+            elif booking and confirm_paid_booking(booking, payment_intent):
+                send_booking_confirmation_emails(booking)
+            elif booking and booking.payment_status != "refund_due":
+                flag_booking_refund(booking, payment_intent)
+
+    # 3) Multi-session plan purchase
+    elif metadata.get("type") == "plan_purchase":
+        plan_id = metadata.get("plan_id")
+        plan = PlanPurchase.query.get(plan_id)
+        if plan and plan.status != "Active":
+            plan.status = "Active"
+            db.session.commit()
+            try:
+                send_plan_confirmation_emails(plan)
+            except Exception:
+                logger.exception("Failed to send plan confirmation emails")
+
+
+def confirm_paid_booking(booking, payment_intent):
+    """
+    Confirm a booking whose checkout completed. Besides Payment Pending,
+    this re-confirms a booking the lock sweeper cancelled because payment
+    took longer than PAYMENT_LOCK_MINUTES, as long as its slot is still
+    free. Returns False if the booking can't hold its slot.
+    """
+    if booking.status == "Cancelled":
+        # Cancelled only ever comes from an expired payment lock; skip
+        # bookings already flagged so a replayed event can't undo a refund
+        if booking.payment_status == "refund_due":
+            return False
+        if db.session.scalar(
+            overlapping_bookings(
+                booking.coach_id, booking.booking_date, booking.start_minute, booking.end_minute
+            ).limit(1)
+        ) is not None:
+            return False
+    elif booking.status != "Payment Pending":
+        return False
+
+    booking.status = "Confirmed"
+    booking.locked_until = None
+    booking.payment_intent_id = payment_intent
+    booking.payment_status = "success"
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # uq_booking_active_slot: someone took the slot since the check
+        db.session.rollback()
+        return False
+    return True
+
+
+def flag_booking_refund(booking, payment_intent):
+    """Record that a paid booking couldn't be confirmed and tell the coach and admin."""
+    booking.payment_intent_id = payment_intent
+    booking.payment_status = "refund_due"
+    db.session.commit()
+    logger.warning(
+        f"Payment received for {booking.status} booking {booking.id}; "
+        f"flagged for refund ({payment_intent})"
+    )
+
+    body = (
+        f"Payment {payment_intent} was received for booking #{booking.id} "
+        f"({booking.student.name} with {booking.coach.name}, "
+        f"{booking.booking_date} {booking.booking_time}), but the booking is "
+        f"{booking.status} and its slot is no longer available.\n\n"
+        "The payment needs to be refunded.\n\n"
+        "- GameChanger Team"
+    )
+    for recipient in {app.config["MAIL_USERNAME"], booking.coach.user.email}:
+        if recipient:
+            msg = Message("Paid booking needs a refund", recipients=[recipient])
+            msg.body = body
+            enqueue_email(msg)
+
+
+# ---------- STRIPE EVENT WORKER ----------
+STRIPE_EVENT_INTERVAL = int(os.getenv("STRIPE_EVENT_INTERVAL", "5"))
+STRIPE_EVENT_MAX_ATTEMPTS = 8
+STRIPE_EVENT_BACKOFF_SECONDS = 30  # doubles each attempt
+STRIPE_EVENT_LEASE_MINUTES = 5
+STRIPE_EVENT_BATCH = 100
+
+# Set by the webhook so this process's worker picks the event up immediately
+stripe_events_wakeup = threading.Event()
+
+
+def claim_stripe_event(event_row_id, due_before):
+    """Lease one queued (or stalled processing) event. Returns True if claimed."""
+    result = db.session.execute(
+        db.update(StripeEvent)
+        .where(
+            StripeEvent.id == event_row_id,
+            StripeEvent.status.in_(["queued", "processing"]),
+            StripeEvent.next_attempt_at <= due_before,
+        )
+        .values(
+            status="processing",
+            next_attempt_at=datetime.utcnow() + timedelta(minutes=STRIPE_EVENT_LEASE_MINUTES),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
 
+def process_stripe_event(event_row_id):
+    """Run the handler for one claimed event, recording success, retry or dead-letter."""
+    row = db.session.get(StripeEvent, event_row_id)
     try:
-        db.session.add(StripeEvent(event_id=event_id))
-        db.session.commit()
-    except Exception:
+        handle_stripe_event(json.loads(row.payload))
+    except Exception as e:
         db.session.rollback()
-        logger.exception("Could not store StripeEvent; aborting to avoid duplicate work.")
-        return ("DB error", 500)
+        row = db.session.get(StripeEvent, event_row_id)
+        row.attempts = (row.attempts or 0) + 1
+        row.last_error = str(e)[:1000]
+        if row.attempts >= STRIPE_EVENT_MAX_ATTEMPTS:
+            row.status = "dead"
+            logger.error(f"Stripe event {row.event_id} moved to dead-letter: {e}")
+        else:
+            row.status = "queued"
+            row.next_attempt_at = datetime.utcnow() + timedelta(
+                seconds=STRIPE_EVENT_BACKOFF_SECONDS * 2 ** (row.attempts - 1)
+            )
+            logger.warning(f"Stripe event {row.event_id} failed (attempt {row.attempts}): {e}")
+        db.session.commit()
+        return False
 
-    try:
-        if event["type"] == "checkout.session.completed":
-            session_obj = event["data"]["object"]
-            metadata = session_obj.get("metadata", {}) or {}
-
-            # 1) Generic subscription / plan purchases (no metadata["type"])
-            if metadata.get("type") is None:
-                client_ref = session_obj.get("client_reference_id")
-                customer_id = session_obj.get("customer")
-                if client_ref:
-                    user = User.query.get(int(client_ref))
-                    if user:
-                        user.stripe_customer_id = customer_id
-                        user.stripe_session_id = session_obj.get("id")
-                        db.session.commit()
-
-            # 2) Single coach booking (existing logic, keep as-is but name must match what you send in metadata)
-            elif metadata.get("type") == "coach_booking":
-             booking_id = metadata.get("booking_id")
-            if booking_id:
-                booking = Booking.query.get(booking_id)
-                if booking:
-                    booking.status = "Confirmed"
-                    booking.locked_until = None
-                    booking.payment_intent_id = session_obj.get("payment_intent")
-                    db.session.commit()
-                    send_booking_confirmation_emails(booking)
-
-            # 3) New: multi-session plan purchase
-            elif metadata.get("type") == "plan_purchase":
-                plan_id = metadata.get("plan_id")
-                plan = PlanPurchase.query.get(plan_id)
-                if plan and plan.status != "Active":
-                    plan.status = "Active"
-                    db.session.commit()
-                    try:
-                        send_plan_confirmation_emails(plan)
-                    except Exception:
-                        logger.exception("Failed to send plan confirmation emails")
+    row.status = "processed"
+    row.processed_at = datetime.utcnow()
+    row.last_error = None
+    db.session.commit()
+    return True
 
-    except Exception:
-        db.session.rollback()
-        logger.exception("Error processing stripe event")
-        return ("Processing error", 500)
 
-    return ("OK", 200)
+def process_stripe_events():
+    """
+    Process due events in (stripe_created, id) order. An event waits while
+    an earlier event for the same object is unfinished, so one object's
+    events apply in order; events in backoff or leased elsewhere are not
+    selected and don't hold up other objects. Returns (processed, failed).
+    """
+    processed = failed = 0
+    now = datetime.utcnow()
+    earlier = db.aliased(StripeEvent)
+    waiting_on_earlier = (
+        db.select(earlier.id)
+        .where(
+            earlier.object_id == StripeEvent.object_id,
+            earlier.status.in_(["queued", "processing"]),
+            db.or_(
+                earlier.stripe_created < StripeEvent.stripe_created,
+                db.and_(
+                    earlier.stripe_created == StripeEvent.stripe_created,
+                    earlier.id < StripeEvent.id,
+                ),
+            ),
+        )
+        .exists()
+    )
+    due_ids = db.session.scalars(
+        db.select(StripeEvent.id)
+        .where(
+            StripeEvent.status.in_(["queued", "processing"]),
+            StripeEvent.next_attempt_at <= now,
+            ~waiting_on_earlier,
+        )
+        .order_by(StripeEvent.stripe_created, StripeEvent.id)
+        .limit(STRIPE_EVENT_BATCH)
+    ).all()
+
+    for event_row_id in due_ids:
+        if not claim_stripe_event(event_row_id, now):
+            continue  # another worker got it first
+        if process_stripe_event(event_row_id):
+            processed += 1
+        else:
+            failed += 1
+
+    return processed, failed
+
+
+def run_stripe_event_worker(interval):
+    while True:
+        stripe_events_wakeup.wait(interval)
+        stripe_events_wakeup.clear()
+        with app.app_context():
+            try:
+                process_stripe_events()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Stripe event worker failed")
+
+
+def start_stripe_event_worker(interval):
+    thread = threading.Thread(
+        target=run_stripe_event_worker, args=(interval,), name="stripe-events", daemon=True
+    )
+    thread.start()
+    return thread
+
 
 def send_booking_confirmation_emails(booking):
     """Sends confirmation emails to both Coach and Student"""
@@ -2126,7 +3814,7 @@ def send_booking_confirmation_emails(booking):
                 f"Date: {booking.booking_date}\nTime: {booking.booking_time}\n\n"
                 "- GameChanger Team"
             )
-            mail.send(msg_coach)
+            enqueue_email(msg_coach)
 
         # Email to Student
         if booking.student.email:
@@ -2140,7 +3828,7 @@ def send_booking_confirmation_emails(booking):
                 f"Date: {booking.booking_date}\nTime: {booking.booking_time}\n\n"
                 "- GameChanger Team"
             )
-            mail.send(msg_student)
+            enqueue_email(msg_student)
             
     except Exception as e:
         logger.error(f"Failed to send confirmation emails: {e}")
@@ -2155,45 +3843,161 @@ def internal_server_error(e):
     return render_template("404.html"), 500
 
 # ---------- GOOGLE SHEETS INTEGRATION ----------
-def save_to_google_sheets(name, phone, email, needs, source="contact_form"):
-    """Save user details to Google Sheets."""
+# Leads are stored in the lead table by /api/contact and appended to the
+# sheet in batches by a background flusher that reuses one authorized client.
+LEADS_FLUSH_INTERVAL = int(os.getenv("LEADS_FLUSH_INTERVAL", "10"))
+LEADS_FLUSH_BATCH = 200
+LEADS_LEASE_MINUTES = 5  # a claimed lead is reclaimed after this
+
+_sheets_lock = threading.Lock()
+_sheets_worksheet = None
+
+
+def get_leads_worksheet():
+    """Authorize once and cache the lead worksheet. Returns None if Sheets isn't configured."""
+    global _sheets_worksheet
     if not GOOGLE_SHEETS_AVAILABLE:
-        logger.warning("Google Sheets not available - skipping save")
-        return False
-    
-    try:
+        return None
+
+    with _sheets_lock:
+        if _sheets_worksheet is not None:
+            return _sheets_worksheet
+
         credentials_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
         sheet_id = os.getenv("GOOGLE_SHEET_ID")
-        
         if not credentials_json or not sheet_id:
-            logger.warning("Google Sheets credentials not configured")
-            return False
-        
+            return None
+
         # Parse credentials JSON string
         creds_dict = json.loads(credentials_json)
         creds = Credentials.from_service_account_info(creds_dict, scopes=[
             'https://www.googleapis.com/auth/spreadsheets',
             'https://www.googleapis.com/auth/drive'
         ])
-        
+
         client = gspread.authorize(creds)
-        sheet = client.open_by_key(sheet_id).sheet1
-        
-        row = [
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            name,
-            phone or "",
-            email or "",
-            needs or "",
-            source
-        ]
-        sheet.append_row(row)
-        logger.info(f"Saved user details to Google Sheets: {name}")
-        return True
-        
+        _sheets_worksheet = client.open_by_key(sheet_id).sheet1
+        return _sheets_worksheet
+
+
+def reset_leads_worksheet():
+    global _sheets_worksheet
+    with _sheets_lock:
+        _sheets_worksheet = None
+
+
+def save_lead(name, phone, email, needs, source="contact_form"):
+    """Buffer a lead for the Sheets flusher."""
+    db.session.add(Lead(
+        name=name,
+        phone=phone or "",
+        email=email or "",
+        needs=needs or "",
+        source=source,
+    ))
+    db.session.commit()
+
+
+def claim_unsynced_leads(limit):
+    """
+    Lease up to `limit` unsynced leads to this flusher. Every worker runs a
+    flusher; the lease keeps two of them from appending the same rows.
+    """
+    now = datetime.utcnow()
+    claimable = (
+        Lead.synced_at.is_(None),
+        db.or_(Lead.claimed_until.is_(None), Lead.claimed_until < now),
+    )
+    ids = db.session.scalars(
+        db.select(Lead.id).where(*claimable).order_by(Lead.id).limit(limit)
+    ).all()
+    if not ids:
+        return []
+
+    token = os.urandom(16).hex()
+    db.session.execute(
+        db.update(Lead)
+        .where(Lead.id.in_(ids), *claimable)
+        .values(claim_token=token, claimed_until=now + timedelta(minutes=LEADS_LEASE_MINUTES))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.scalars(
+        db.select(Lead).where(Lead.claim_token == token).order_by(Lead.id)
+    ).all()
+
+
+def flush_leads_to_sheets(batch_size=LEADS_FLUSH_BATCH):
+    """Append unsynced leads to Google Sheets with append_rows. Returns the number written."""
+    try:
+        sheet = get_leads_worksheet()
     except Exception as e:
-        logger.error(f"Error saving to Google Sheets: {e}")
-        return False
+        logger.error(f"Error connecting to Google Sheets: {e}")
+        return 0
+    if sheet is None:
+        return 0
+
+    written = 0
+    while True:
+        leads = claim_unsynced_leads(batch_size)
+        if not leads:
+            break
+
+        rows = [
+            [
+                lead.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+                lead.name,
+                lead.phone or "",
+                lead.email or "",
+                lead.needs or "",
+                lead.source,
+            ]
+            for lead in leads
+        ]
+        try:
+            sheet.append_rows(rows)
+        except Exception as e:
+            # Drop the cached client in case its token or handle went bad,
+            # and hand the rows back for the next flush
+            reset_leads_worksheet()
+            logger.error(f"Error saving leads to Google Sheets: {e}")
+            for lead in leads:
+                lead.claim_token = lead.claimed_until = None
+            db.session.commit()
+            break
+
+        now = datetime.utcnow()
+        for lead in leads:
+            lead.synced_at = now
+            lead.claim_token = lead.claimed_until = None
+        db.session.commit()
+        written += len(leads)
+
+        if len(leads) < batch_size:
+            break
+
+    if written:
+        logger.info(f"Saved {written} leads to Google Sheets")
+    return written
+
+
+def run_leads_flusher(interval):
+    while True:
+        time_module.sleep(interval)
+        with app.app_context():
+            try:
+                flush_leads_to_sheets()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Leads flusher failed")
+
+
+def start_leads_flusher(interval):
+    thread = threading.Thread(
+        target=run_leads_flusher, args=(interval,), name="leads-flusher", daemon=True
+    )
+    thread.start()
+    return thread
 
 # ---------- CONTACT/LEAD CAPTURE ROUTE ----------
 @app.route("/api/contact", methods=["POST"])
@@ -2235,14 +4039,14 @@ def contact_submit():
     if needs and len(needs) > 2000:
         return jsonify({"success": False, "message": "Needs field is too long (max 2000 characters)"}), 400
     
-    # Save to Google Sheets
+    # Buffer the lead; the flusher writes it to Google Sheets
     # Sanitize inputs before saving
     name_safe = sanitize_input(name, max_length=120)
     phone_safe = sanitize_input(phone, max_length=15) if phone else ""
     email_safe = email.lower() if email else ""
     needs_safe = sanitize_input(needs, max_length=2000) if needs else ""
     
-    save_to_google_sheets(name_safe, phone_safe, email_safe, needs_safe, source)
+    save_lead(name_safe, phone_safe, email_safe, needs_safe, sanitize_input(source, max_length=50))
     return jsonify({
         "success": True,
         "message": "Thank you! We'll get back to you soon."
@@ -2394,6 +4198,72 @@ def add_coach_venue():
     flash("Venue added successfully!", "success")
     return redirect(url_for("coach_profile"))
 
+def is_date_blocked(coach_id, date_obj):
+    """Indexed point lookup on coach_blocked_date."""
+    return db.session.scalar(
+        db.select(CoachBlockedDate.id).where(
+            CoachBlockedDate.coach_id == coach_id,
+            CoachBlockedDate.date == date_obj,
+        )
+    ) is not None
+
+
+def get_blocked_dates(coach_id, start_date, end_date=None):
+    """Set of the coach's blocked dates from start_date through end_date (open-ended if None)."""
+    query = db.select(CoachBlockedDate.date).where(
+        CoachBlockedDate.coach_id == coach_id,
+        CoachBlockedDate.date >= start_date,
+    )
+    if end_date is not None:
+        query = query.where(CoachBlockedDate.date <= end_date)
+    return set(db.session.scalars(query))
+
+
+def parse_blocked_dates(raw):
+    """Parse Coach.availability_json into a set of blocked dates."""
+    try:
+        entries = json.loads(raw or "{}")
+    except ValueError:
+        return set()
+
+    dates = set()
+    for key, value in entries.items():
+        if not (isinstance(value, dict) and value.get("blocked")):
+            continue
+        try:
+            dates.add(datetime.strptime(key, "%Y-%m-%d").date())
+        except ValueError:
+            continue
+    return dates
+
+
+def compute_day_slots(availabilities, booked_spans):
+    """
+    Free slots for one day, given that weekday's CoachAvailability rows
+    and the (start_minute, end_minute) of every slot-holding booking on
+    that date. A slot is taken if any booking overlaps it.
+    """
+    daily_count = len(booked_spans)
+    available_slots = []
+
+    for a in availabilities:
+
+        # Enforce max sessions per day
+        if daily_count >= a.max_sessions_per_day:
+            break
+
+        # Slot m overlaps booking [s, e) iff s - duration < m < e
+        duration = a.slot_duration_minutes
+        template = a.slot_minutes()
+        taken = set()
+        for s, e in booked_spans:
+            taken.update(template[bisect_left(template, s - duration + 1):bisect_left(template, e)])
+
+        available_slots.extend(format_minutes(m) for m in template if m not in taken)
+
+    return available_slots
+
+
 @app.route("/api/coach/<int:coach_id>/slots")
 def get_available_slots(coach_id):
     date_str = request.args.get("date")
@@ -2407,15 +4277,7 @@ def get_available_slots(coach_id):
     coach = Coach.query.get_or_404(coach_id)
 
     # ---------------- BLOCKED DATE CHECK ----------------
-    blocked = {}
-    if coach.availability_json:
-        try:
-            blocked = json.loads(coach.availability_json)
-        except Exception:
-            blocked = {}
-
-    date_key = date_obj.strftime("%Y-%m-%d")
-    if date_key in blocked and blocked[date_key].get("blocked"):
+    if is_date_blocked(coach.id, date_obj):
         return jsonify({"slots": []})
 
     # ---------------- WEEKDAY AVAILABILITY ----------------
@@ -2427,46 +4289,85 @@ def get_available_slots(coach_id):
         is_active=True
     ).all()
 
-    # ---------------- DAILY BOOKING COUNT (FIXED) ----------------
-    daily_count = Booking.query.filter(
-        Booking.coach_id == coach.id,
-        Booking.booking_date == date_obj,
-        (
-            (Booking.status == "Confirmed") |
-            (
-                (Booking.status == "Payment Pending") &
-                (Booking.locked_until > datetime.utcnow())
-            )
-        )
-    ).count()   # ✅ THIS IS THE CRITICAL FIX
+    # ---------------- DAY'S BOOKINGS (ONE QUERY) ----------------
+    booked_spans = get_booked_spans(coach.id, date_obj)
 
-    available_slots = []
+    return jsonify({"slots": compute_day_slots(availabilities, booked_spans)})
 
-    # ---------------- SLOT GENERATION ----------------
-    for a in availabilities:
 
-        # Enforce max sessions per day
-        if daily_count >= a.max_sessions_per_day:
-            break
+CALENDAR_MAX_DAYS = 60
 
-        slots = generate_time_slots(
-            a.start_time,
-            a.end_time,
-            a.slot_duration_minutes
-        )
 
-        for s in slots:
-            existing = Booking.query.filter(
-                Booking.coach_id == coach.id,
-                Booking.booking_date == date_obj,
-                Booking.booking_time == s,
-                Booking.status.in_(["Confirmed", "Payment Pending"])
-            ).first()
+@app.route("/api/coach/<int:coach_id>/calendar")
+def get_availability_calendar(coach_id):
+    """
+    Free slots for every date in [from, to] (inclusive, max 60 days).
+    One CoachAvailability query and one Booking query cover the whole range.
+    """
+    from_str = request.args.get("from")
+    to_str = request.args.get("to")
+    if not from_str:
+        return jsonify({"error": "from is required"}), 400
+
+    valid, start_date = validate_date(from_str)
+    if not valid:
+        return jsonify({"error": start_date}), 400
+
+    if to_str:
+        valid, end_date = validate_date(to_str)
+        if not valid:
+            return jsonify({"error": end_date}), 400
+    else:
+        end_date = start_date + timedelta(days=29)
+
+    if end_date < start_date:
+        return jsonify({"error": "to must not be before from"}), 400
+    if (end_date - start_date).days + 1 > CALENDAR_MAX_DAYS:
+        return jsonify({"error": f"Range cannot exceed {CALENDAR_MAX_DAYS} days"}), 400
 
-            if not existing:
-                available_slots.append(s)
+    coach = Coach.query.get_or_404(coach_id)
+    blocked = get_blocked_dates(coach.id, start_date, end_date)
+
+    # ---------------- WEEKLY TEMPLATE (ONE QUERY) ----------------
+    by_weekday = {}
+    rows = CoachAvailability.query.filter_by(
+        coach_id=coach.id,
+        is_active=True
+    ).all()
+    for a in rows:
+        by_weekday.setdefault(a.day_of_week, []).append(a)
+
+    # ---------------- RANGE BOOKINGS (ONE QUERY) ----------------
+    booked_by_date = {}
+    bookings = db.session.query(
+        Booking.booking_date, Booking.start_minute, Booking.end_minute
+    ).filter(
+        Booking.coach_id == coach.id,
+        Booking.booking_date >= start_date,
+        Booking.booking_date <= end_date,
+        active_booking_filter(),
+    ).all()
+    for b in bookings:
+        booked_by_date.setdefault(b.booking_date, []).append((b.start_minute, b.end_minute))
+
+    days = {}
+    current = start_date
+    while current <= end_date:
+        date_key = current.strftime("%Y-%m-%d")
+        if current in blocked:
+            days[date_key] = []
+        else:
+            days[date_key] = compute_day_slots(
+                by_weekday.get(get_weekday(current), []),
+                booked_by_date.get(current, []),
+            )
+        current += timedelta(days=1)
 
-    return jsonify({"slots": available_slots})
+    return jsonify({
+        "from": start_date.strftime("%Y-%m-%d"),
+        "to": end_date.strftime("%Y-%m-%d"),
+        "days": days,
+    })
 @app.route("/booking/success/<int:booking_id>")
 @login_required
 def booking_success(booking_id):
@@ -2512,6 +4413,614 @@ def payment_page(booking_id):
 
     return render_template("payment.html", booking=booking)
 
+# ---------- SCHEMA MIGRATIONS ----------
+# db.create_all() only creates missing tables. Changes to existing tables
+# and data backfills are numbered steps in MIGRATIONS; `flask --app app
+# migrate-db` runs the ones not yet recorded in schema_migration, in
+# order. Each step spells out its own DDL, so what a version does never
+# depends on how the models look when it runs. Steps are idempotent.
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migration"
+
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def add_column(table, column, ddl_type):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists."""
+    with db.engine.begin() as conn:
+        # Read the columns from a SELECT rather than the inspector: SQLite
+        # connections can return a stale cached PRAGMA table_info.
+        existing = conn.exec_driver_sql(f"SELECT * FROM {table} WHERE 1 = 0").keys()
+        if column not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+
+
+def create_index(name, table, columns, unique=False, where=None):
+    """CREATE [UNIQUE] INDEX IF NOT EXISTS, optionally partial (SQLite and PostgreSQL)."""
+    sql = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+    if where:
+        sql += f" WHERE {where}"
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(sql)
+
+
+def create_table(model):
+    """Create a table a step introduces (with its indexes) if it is missing."""
+    model.__table__.create(db.engine, checkfirst=True)
+
+
+def add_coach_search_schema():
+    add_column("coach", "city_key", "VARCHAR(120)")
+    create_index("ix_coach_city_key", "coach", "city_key")
+    create_index("ix_coach_price_per_session", "coach", "price_per_session")
+    create_index("ix_coach_rating_id", "coach", "rating, id")
+    create_table(CoachSport)
+
+
+def add_coach_stats_columns():
+    add_column("coach", "badge_label", "VARCHAR(30)")
+    add_column("coach", "profile_completion", "INTEGER")
+    create_index("ix_coach_badge_label", "coach", "badge_label")
+    create_index("ix_coach_profile_completion", "coach", "profile_completion")
+
+
+def add_rating_aggregate_columns():
+    add_column("coach", "review_count", "INTEGER")
+    add_column("coach", "rating_sum", "INTEGER")
+
+
+def add_booking_price_column():
+    add_column("booking", "price", "INTEGER")
+
+
+def cancel_duplicate_active_bookings():
+    """
+    uq_booking_active_slot allows one active booking per slot. Cancel
+    expired payment holds, then keep one booking per still-duplicated slot
+    (Confirmed over Payment Pending, then the oldest) and cancel the rest.
+    Returns the number of bookings cancelled.
+    """
+    cancelled = release_expired_locks()
+
+    active = Booking.status.in_(["Confirmed", "Payment Pending"])
+    slot = (Booking.coach_id, Booking.booking_date, Booking.booking_time)
+    duplicated = db.session.execute(
+        db.select(*slot).where(active).group_by(*slot).having(db.func.count(Booking.id) > 1)
+    ).all()
+
+    for coach_id, booking_date, booking_time in duplicated:
+        ids = db.session.scalars(
+            db.select(Booking.id)
+            .where(
+                Booking.coach_id == coach_id,
+                Booking.booking_date == booking_date,
+                Booking.booking_time == booking_time,
+                active,
+            )
+            .order_by(db.case((Booking.status == "Confirmed", 0), else_=1), Booking.id)
+        ).all()
+        db.session.execute(
+            db.update(Booking)
+            .where(Booking.id.in_(ids[1:]))
+            .values(status="Cancelled", locked_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        logger.warning(
+            f"Slot {coach_id}/{booking_date}/{booking_time} was double booked: "
+            f"kept booking {ids[0]}, cancelled {ids[1:]}"
+        )
+        cancelled += len(ids) - 1
+
+    db.session.commit()
+    return cancelled
+
+
+def add_active_slot_index():
+    create_index(
+        "uq_booking_active_slot", "booking", "coach_id, booking_date, booking_time",
+        unique=True, where="status IN ('Confirmed', 'Payment Pending')",
+    )
+
+
+def add_stripe_event_queue_columns():
+    add_column("stripe_event", "event_type", "VARCHAR(100)")
+    add_column("stripe_event", "object_id", "VARCHAR(255)")
+    add_column("stripe_event", "stripe_created", "INTEGER")
+    add_column("stripe_event", "payload", "TEXT")
+    # Left NULL on rows stored before the queue so the worker ignores them
+    add_column("stripe_event", "status", "VARCHAR(20)")
+    add_column("stripe_event", "attempts", "INTEGER")
+    add_column("stripe_event", "next_attempt_at", "TIMESTAMP")
+    add_column("stripe_event", "last_error", "TEXT")
+    add_column("stripe_event", "processed_at", "TIMESTAMP")
+    create_index("ix_stripe_event_object_id", "stripe_event", "object_id")
+    create_index("ix_stripe_event_status_order", "stripe_event", "status, stripe_created, id")
+
+
+def add_hot_path_indexes():
+    create_index("ix_review_coach_user", "review", "coach_id, user_id")
+    create_index(
+        "ix_booking_coach_slot_status", "booking", "coach_id, booking_date, booking_time, status"
+    )
+    create_index("ix_booking_user_date", "booking", "user_id, booking_date")
+    create_index("ix_booking_status_locked_until", "booking", "status, locked_until")
+    create_index(
+        "ix_coach_availability_coach_day", "coach_availability", "coach_id, day_of_week, is_active"
+    )
+
+
+def add_booking_span_columns():
+    add_column("booking", "start_minute", "INTEGER")
+    add_column("booking", "end_minute", "INTEGER")
+    create_index(
+        "ix_booking_coach_day_span", "booking", "coach_id, booking_date, start_minute, end_minute"
+    )
+
+
+def add_coach_updated_at_column():
+    add_column("coach", "updated_at", "TIMESTAMP")
+    create_index("ix_coach_updated_at", "coach", "updated_at")
+
+
+def backfill_coach_search():
+    """Rebuild coach_sport / Coach.city_key for every coach. Returns the coach count."""
+    last_id = 0
+    total = 0
+    while True:
+        batch = Coach.query.filter(Coach.id > last_id).order_by(Coach.id).limit(500).all()
+        if not batch:
+            break
+        for coach in batch:
+            coach.sync_search_keys()
+        db.session.commit()
+        last_id = batch[-1].id
+        total += len(batch)
+    return total
+
+
+def refresh_all_coach_stats():
+    """Recompute badge_label / profile_completion for every coach. Returns the coach count."""
+    last_id = 0
+    total = 0
+    while True:
+        batch = Coach.query.filter(Coach.id > last_id).order_by(Coach.id).limit(500).all()
+        if not batch:
+            break
+        for coach in batch:
+            coach.refresh_profile_stats()
+        db.session.commit()
+        last_id = batch[-1].id
+        total += len(batch)
+    return total
+
+
+def reconcile_ratings():
+    """Rebuild review_count / rating_sum / rating from the review table. Returns coaches changed."""
+    totals = {
+        row.coach_id: (row.review_count, row.rating_sum)
+        for row in db.session.query(
+            Review.coach_id,
+            db.func.count(Review.id).label("review_count"),
+            db.func.sum(Review.rating).label("rating_sum"),
+        ).group_by(Review.coach_id)
+    }
+
+    changed = 0
+    for coach in Coach.query.order_by(Coach.id).all():
+        review_count, rating_sum = totals.get(coach.id, (0, 0))
+        if (coach.review_count, coach.rating_sum) != (review_count, rating_sum):
+            changed += 1
+        coach.review_count = review_count
+        coach.rating_sum = rating_sum
+        coach.rating = coach.calculate_rating()
+
+    db.session.commit()
+    return changed
+
+
+def migrate_blocked_dates():
+    """
+    Move Coach.availability_json entries into coach_blocked_date and clear
+    the JSON, so a later run can't restore dates a coach has since
+    unblocked. Returns (dates, coaches).
+    """
+    total = 0
+    coaches = 0
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            db.select(Coach.id, Coach.availability_json)
+            .where(Coach.id > last_id)
+            .order_by(Coach.id)
+            .limit(500)
+        ).all()
+        if not batch:
+            break
+        moved = []
+        for coach_id, raw in batch:
+            dates = parse_blocked_dates(raw)
+            if not dates:
+                continue
+            moved.append(coach_id)
+            existing = get_blocked_dates(coach_id, min(dates))
+            new_dates = dates - existing
+            if not new_dates:
+                continue
+            db.session.add_all(
+                CoachBlockedDate(coach_id=coach_id, date=d) for d in sorted(new_dates)
+            )
+            total += len(new_dates)
+            coaches += 1
+        if moved:
+            db.session.execute(
+                db.update(Coach)
+                .where(Coach.id.in_(moved))
+                .values(availability_json="{}")
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+        last_id = batch[-1].id
+    return total, coaches
+
+
+def backfill_coach_updated_at():
+    """Stamp Coach.updated_at on existing rows. Returns the rows updated."""
+    result = db.session.execute(
+        db.update(Coach)
+        .where(Coach.updated_at.is_(None))
+        .values(updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def backfill_slot_templates():
+    """Store CoachAvailability.slot_template for every row. Returns the rows updated."""
+    total = 0
+    for availability in CoachAvailability.query.filter(
+        CoachAvailability.slot_template.is_(None)
+    ).all():
+        # Any column change fires before_update, which rebuilds the template
+        availability.slot_template = ""
+        total += 1
+    db.session.commit()
+    return total
+
+
+def backfill_booking_minutes():
+    """Fill Booking.start_minute / end_minute from booking_time. Returns the rows updated."""
+    last_id = 0
+    total = 0
+    while True:
+        batch = Booking.query.filter(
+            Booking.id > last_id, Booking.start_minute.is_(None)
+        ).order_by(Booking.id).limit(500).all()
+        if not batch:
+            break
+        for booking in batch:
+            try:
+                booking.start_minute = to_minutes(booking.booking_time)
+            except ValueError:
+                continue
+            booking.end_minute = booking.start_minute + DEFAULT_SESSION_MINUTES
+            total += 1
+        db.session.commit()
+        last_id = batch[-1].id
+    return total
+
+
+# (version, description, step). Append only; never renumber. The schema
+# steps come first: the backfills load full model rows, so every column
+# the models map must exist before they run.
+MIGRATIONS = [
+    (1, "Coach directory search: city_key, coach_sport, price/rating indexes",
+     add_coach_search_schema),
+    (2, "Coach.badge_label / profile_completion columns", add_coach_stats_columns),
+    (3, "Coach.review_count / rating_sum columns", add_rating_aggregate_columns),
+    (4, "Booking.price column", add_booking_price_column),
+    (5, "Cancel expired and duplicate active bookings", cancel_duplicate_active_bookings),
+    (6, "Unique index on active booking slots", add_active_slot_index),
+    (7, "outbound_email table", lambda: create_table(OutboundEmail)),
+    (8, "newsletter_job table", lambda: create_table(NewsletterJob)),
+    (9, "lead table", lambda: create_table(Lead)),
+    (10, "Stripe event queue columns", add_stripe_event_queue_columns),
+    (11, "Coach.image_variants column", lambda: add_column("coach", "image_variants", "BOOLEAN")),
+    (12, "coach_blocked_date table", lambda: create_table(CoachBlockedDate)),
+    (13, "Hot-path indexes on booking, review and coach_availability", add_hot_path_indexes),
+    (14, "Booking.start_minute / end_minute columns", add_booking_span_columns),
+    (15, "CoachAvailability.slot_template column",
+     lambda: add_column("coach_availability", "slot_template", "TEXT")),
+    (16, "Coach.updated_at column", add_coach_updated_at_column),
+    (17, "Backfill coach_sport and Coach.city_key", backfill_coach_search),
+    (18, "Backfill Coach.badge_label and profile_completion", refresh_all_coach_stats),
+    (19, "Rebuild coach rating aggregates from reviews", reconcile_ratings),
+    (20, "Move blocked dates out of Coach.availability_json", migrate_blocked_dates),
+    (21, "Backfill Booking.start_minute / end_minute", backfill_booking_minutes),
+    (22, "Backfill CoachAvailability.slot_template", backfill_slot_templates),
+    (23, "Stamp Coach.updated_at", backfill_coach_updated_at),
+]
+
+
+def pending_migrations():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = set(db.session.scalars(db.select(SchemaMigration.version)))
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def run_migrations():
+    """Apply pending migrations in order. Returns the (version, name) pairs applied."""
+    # An empty database gets the current schema from create_all; the steps
+    # are only recorded, since they exist to bring older databases up to it.
+    fresh = not db.inspect(db.engine).has_table(Coach.__tablename__)
+    if fresh:
+        db.create_all()
+
+    applied = []
+    for version, name, step in pending_migrations():
+        logger.info(f"Applying migration {version}: {name}")
+        if not fresh:
+            step()
+        db.session.add(SchemaMigration(version=version, name=name))
+        db.session.commit()
+        applied.append((version, name))
+    return applied
+
+
+# ---------- QUERY PLAN CHECK ----------
+def hot_queries():
+    """One representative statement per hot predicate, keyed by where it is used."""
+    now = datetime.utcnow()
+    today = now.date()
+    return {
+        "slots": db.select(Booking.start_minute, Booking.end_minute).where(
+            Booking.coach_id == 1, Booking.booking_date == today, active_booking_filter(now)
+        ),
+        "overlap check": overlapping_bookings(1, today, 600, 660),
+        "slot holder release": db.select(Booking.id).where(
+            Booking.coach_id == 1,
+            Booking.booking_date == today,
+            Booking.booking_time == "09:00",
+            Booking.status == "Payment Pending",
+            Booking.locked_until < now,
+        ),
+        "calendar range": db.select(Booking.booking_date, Booking.start_minute).where(
+            Booking.coach_id == 1,
+            Booking.booking_date >= today,
+            Booking.booking_date <= today + timedelta(days=30),
+            active_booking_filter(now),
+        ),
+        "my bookings": db.select(Booking.id)
+            .where(Booking.user_id == 1)
+            .order_by(Booking.booking_date.desc()),
+        "expired locks": db.select(Booking.id).where(
+            Booking.status == "Payment Pending", Booking.locked_until < now
+        ),
+        "existing review": db.select(Review.id).filter_by(coach_id=1, user_id=1),
+        "weekday availability": db.select(CoachAvailability.id).filter_by(
+            coach_id=1, day_of_week=0, is_active=True
+        ),
+        "blocked date": db.select(CoachBlockedDate.id).where(
+            CoachBlockedDate.coach_id == 1, CoachBlockedDate.date == today
+        ),
+        "sport filter": db.select(CoachSport.coach_id).where(CoachSport.sport_key == "cricket"),
+        "directory version": db.select(db.func.max(Coach.updated_at)),
+    }
+
+
+def explain_full_scans(statement):
+    """
+    Return (plan lines, full-scan lines) for a statement. On PostgreSQL
+    sequential scans are disabled for the EXPLAIN, so a "Seq Scan" means
+    no usable index exists (small tables would otherwise always seq scan).
+    """
+    dialect = db.engine.dialect.name
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+
+    with db.engine.connect() as conn:
+        if dialect == "sqlite":
+            lines = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+            scans = [line for line in lines if line.startswith("SCAN ")]
+        elif dialect == "postgresql":
+            with conn.begin():
+                conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+                lines = [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {sql}")]
+            scans = [line for line in lines if "Seq Scan" in line]
+        else:
+            raise click.ClickException(f"Query plan check does not support {dialect}")
+    return lines, scans
+
+
+# ---------- CLI COMMANDS ----------
+@app.cli.command("migrate-db")
+@click.option("--status", is_flag=True, help="List pending migrations without applying them.")
+def migrate_db_command(status):
+    """Apply pending schema/data migrations (run on every deploy)."""
+    if status:
+        pending = pending_migrations()
+        for version, name, _ in pending:
+            print(f"pending  {version:>3}  {name}")
+        print(f"{len(pending)} pending migrations.")
+        return
+
+    applied = run_migrations()
+    for version, name in applied:
+        print(f"applied  {version:>3}  {name}")
+    print(f"Applied {len(applied)} migrations; schema is up to date.")
+
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """EXPLAIN every hot query; exit 1 if any of them falls back to a full table scan."""
+    failed = 0
+    for name, statement in hot_queries().items():
+        lines, scans = explain_full_scans(statement)
+        print(f"{'FULL SCAN' if scans else 'ok':<9}  {name}")
+        for line in lines:
+            print(f"           {line}")
+        failed += bool(scans)
+
+    if failed:
+        print(f"{failed} hot queries fall back to a full scan.")
+        raise SystemExit(1)
+    print("All hot queries use an index.")
+
+
+@app.cli.command("reconcile-ratings")
+def reconcile_ratings_command():
+    """Rebuild Coach.review_count / rating_sum / rating from the review table."""
+    print(f"Reconciled rating aggregates: {reconcile_ratings()} coaches changed.")
+
+
+@app.cli.command("sweep-locks")
+@click.option("--loop", "interval", type=int, default=0,
+              help="Keep running, sweeping every INTERVAL seconds.")
+@click.option("--batch-size", type=int, default=LOCK_SWEEP_BATCH, show_default=True)
+def sweep_locks_command(interval, batch_size):
+    """Cancel Payment Pending bookings whose payment lock has expired."""
+    while True:
+        started = time_module.monotonic()
+        released = release_expired_locks(batch_size=batch_size)
+        elapsed_ms = (time_module.monotonic() - started) * 1000
+        print(f"Released {released} expired payment locks in {elapsed_ms:.0f} ms.")
+        if interval <= 0:
+            break
+        time_module.sleep(interval)
+
+
+@app.cli.command("process-coach-images")
+def process_coach_images_command():
+    """Generate resized photo variants for existing coach uploads."""
+    if not PIL_AVAILABLE:
+        print("Pillow is not installed; nothing to do.")
+        return
+
+    query = db.select(Coach.profile_image).distinct().where(
+        Coach.profile_image.is_not(None),
+        Coach.profile_image != "",
+        Coach.profile_image != "default_coach.jpg",
+        db.or_(Coach.image_variants.is_(None), Coach.image_variants.is_(False)),
+    )
+
+    updated = 0
+    missing = 0
+    for filename in db.session.scalars(query).all():
+        if not os.path.exists(os.path.join(app.config["UPLOAD_FOLDER"], filename)):
+            missing += 1
+            continue
+        updated += process_coach_image(filename)
+
+    print(f"Generated image variants for {updated} coaches ({missing} uploads missing).")
+
+
+@app.cli.command("build-static")
+def build_static_command():
+    """Fingerprint static assets into static/build (run on deploy, then restart)."""
+    manifest = build_static_assets()
+    encodings = "gzip + brotli" if BROTLI_AVAILABLE else "gzip"
+    print(f"Fingerprinted {len(manifest)} static files ({encodings} for text assets).")
+
+
+@app.cli.command("run-newsletter")
+@click.argument("job_id", type=int)
+def run_newsletter_command(job_id):
+    """Run (or resume) a newsletter job in the foreground."""
+    run_newsletter_job(job_id)
+    job = db.session.get(NewsletterJob, job_id)
+    if job is None:
+        print(f"No newsletter job {job_id}.")
+        return
+    print(f"Job {job.id} {job.status}: {job.sent_count} sent, {job.failed_count} failed "
+          f"of {job.total_count}.")
+
+
+@app.cli.command("flush-leads")
+def flush_leads_command():
+    """Append buffered contact-form leads to Google Sheets."""
+    written = flush_leads_to_sheets()
+    pending = Lead.query.filter(Lead.synced_at.is_(None)).count()
+    print(f"Wrote {written} leads to Google Sheets, {pending} still pending.")
+
+
+@app.cli.command("process-stripe-events")
+def process_stripe_events_command():
+    """Process queued Stripe webhook events."""
+    processed, failed = process_stripe_events()
+    print(f"Processed {processed} Stripe events, {failed} failed.")
+
+
+@app.cli.command("replay-stripe-events")
+@click.argument("event_ids", nargs=-1)
+@click.option("--dead", is_flag=True, help="Replay every dead-lettered event.")
+@click.option("--since", type=click.DateTime(), default=None,
+              help="Replay every event received since this time (UTC).")
+def replay_stripe_events_command(event_ids, dead, since):
+    """Re-queue stored Stripe events (by id, --dead or --since) and process them."""
+    conditions = []
+    if event_ids:
+        conditions.append(StripeEvent.event_id.in_(event_ids))
+    if dead:
+        conditions.append(StripeEvent.status == "dead")
+    if since:
+        conditions.append(StripeEvent.created_at >= since)
+    if not conditions:
+        print("Nothing selected: pass event ids, --dead or --since.")
+        return
+
+    result = db.session.execute(
+        db.update(StripeEvent)
+        .where(db.or_(*conditions), StripeEvent.payload.isnot(None))
+        .values(status="queued", attempts=0, next_attempt_at=datetime.utcnow(), last_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    print(f"Re-queued {result.rowcount} Stripe events.")
+
+    processed, failed = process_stripe_events()
+    print(f"Processed {processed} Stripe events, {failed} failed.")
+
+
+@app.cli.command("send-emails")
+@click.option("--loop", "interval", type=int, default=0,
+              help="Keep running, dispatching every INTERVAL seconds.")
+def send_emails_command(interval):
+    """Send queued outbox emails through the worker pool."""
+    with ThreadPoolExecutor(max_workers=EMAIL_WORKERS, thread_name_prefix="email") as executor:
+        while True:
+            sent, failed = dispatch_pending_emails(executor)
+            print(f"Sent {sent} emails, {failed} failed or rescheduled.")
+            if interval <= 0:
+                break
+            time_module.sleep(interval)
+
+
+# Background workers start with the first request, so CLI commands
+# importing the app don't spawn them.
+_background_workers_started = False
+_background_workers_lock = threading.Lock()
+
+
+@app.before_request
+def start_background_workers():
+    global _background_workers_started
+    if _background_workers_started or app.testing:
+        return
+    with _background_workers_lock:
+        if _background_workers_started:
+            return
+        if EMAIL_DISPATCH_INTERVAL > 0:
+            start_email_dispatcher(EMAIL_DISPATCH_INTERVAL)
+        if STRIPE_EVENT_INTERVAL > 0:
+            start_stripe_event_worker(STRIPE_EVENT_INTERVAL)
+        if LOCK_SWEEP_INTERVAL > 0:
+            start_lock_sweeper(LOCK_SWEEP_INTERVAL)
+        if LEADS_FLUSH_INTERVAL > 0 and GOOGLE_SHEETS_AVAILABLE:
+            start_leads_flusher(LEADS_FLUSH_INTERVAL)
+        _background_workers_started = True
+
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
@@ -0,0 +1,126 @@
+"""
+Benchmark for /api/coach/<id>/slots.
+
+Seeds one coach (06:00-22:00, 30 min slots, a few bookings) in a throwaway
+SQLite DB and compares the old one-query-per-slot lookup with the current
+set-based slot engine: SQL statements per request and p50/p95 latency.
+
+Usage: python bench_slots.py [iterations]
+"""
+import os
+import sys
+import tempfile
+import time as clock
+from datetime import date, time, timedelta
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench_slots.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_FILE
+
+from sqlalchemy import event  # noqa: E402
+
+from app import (  # noqa: E402
+    app, db, User, Coach, CoachAvailability, Booking,
+    generate_time_slots, get_weekday, to_minutes,
+)
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+query_count = 0
+
+
+def count_query(*args, **kwargs):
+    global query_count
+    query_count += 1
+
+
+def seed():
+    user = User(name="Bench Coach", email="bench@coach.com", role="coach")
+    user.set_password("password1")
+    student = User(name="Bench Student", email="bench@student.com", role="hirer")
+    student.set_password("password1")
+    db.session.add_all([user, student])
+    db.session.commit()
+
+    coach = Coach(
+        user_id=user.id, slug="bench-coach-cricket", name="Bench Coach",
+        sport="Cricket", price_per_session=500, city="Mumbai",
+    )
+    db.session.add(coach)
+    db.session.commit()
+
+    for day in range(7):
+        db.session.add(CoachAvailability(
+            coach_id=coach.id, day_of_week=day,
+            start_time=time(6, 0), end_time=time(22, 0),
+            slot_duration_minutes=30, max_sessions_per_day=40,
+        ))
+
+    target = date.today() + timedelta(days=3)
+    for slot in ["07:00", "09:30", "18:00"]:
+        db.session.add(Booking(
+            coach_id=coach.id, user_id=student.id, sport="Cricket",
+            booking_date=target, booking_time=slot, status="Confirmed",
+            start_minute=to_minutes(slot), end_minute=to_minutes(slot) + 30,
+        ))
+    db.session.commit()
+    return coach.id, target
+
+
+def legacy_slots(coach_id, date_obj):
+    """The pre-engine implementation: one Booking query per generated slot."""
+    availabilities = CoachAvailability.query.filter_by(
+        coach_id=coach_id, day_of_week=get_weekday(date_obj), is_active=True
+    ).all()
+    available = []
+    for a in availabilities:
+        for s in generate_time_slots(a.start_time, a.end_time, a.slot_duration_minutes):
+            existing = Booking.query.filter(
+                Booking.coach_id == coach_id,
+                Booking.booking_date == date_obj,
+                Booking.booking_time == s,
+                Booking.status.in_(["Confirmed", "Payment Pending"]),
+            ).first()
+            if not existing:
+                available.append(s)
+    return available
+
+
+def measure(label, fn):
+    global query_count
+    timings = []
+    queries = 0
+    for _ in range(ITERATIONS):
+        query_count = 0
+        start = clock.perf_counter()
+        fn()
+        timings.append((clock.perf_counter() - start) * 1000)
+        queries = query_count
+    timings.sort()
+    p50 = timings[len(timings) // 2]
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<8} queries/request={queries:<4} p50={p50:.2f}ms p95={p95:.2f}ms")
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        event.listen(db.engine, "before_cursor_execute", count_query)
+        coach_id, target = seed()
+        client = app.test_client()
+        url = f"/api/coach/{coach_id}/slots?date={target.isoformat()}"
+
+        def after():
+            db.session.remove()
+            client.get(url)
+
+        def before():
+            db.session.remove()
+            db.session.get(Coach, coach_id)
+            legacy_slots(coach_id, target)
+
+        print(f"Seeded coach {coach_id}, {ITERATIONS} iterations on {target}")
+        measure("before", before)
+        measure("after", after)
+
+
+if __name__ == "__main__":
+    main()
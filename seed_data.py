@@ -106,6 +106,7 @@ def seed():
                     rating=round(random.uniform(4.0, 5.0), 1),
                     is_verified=True
                 )
+                coach.sync_search_keys()
                 db.session.add(coach)
         
         db.session.commit()
@@ -0,0 +1,148 @@
+import os
+import sys
+import tempfile
+from datetime import date, time, timedelta
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+# app.py reads its configuration at import time. TEST_DATABASE_URL points the
+# suite at Postgres; otherwise it runs against a throwaway SQLite file (a file,
+# not :memory:, so worker threads share it).
+_tmpdir = tempfile.mkdtemp(prefix="gamechanger-tests-")
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL", "sqlite:///" + os.path.join(_tmpdir, "test.db")
+)
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as gamechanger  # noqa: E402
+from smtp_stub import SMTPStub  # noqa: E402
+
+# Hashed once: the default scrypt hash per user would dominate the suite
+PASSWORD_HASH = generate_password_hash("password1")
+
+
+@pytest.fixture
+def app():
+    flask_app = gamechanger.app
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, MAIL_SUPPRESS_SEND=True)
+    with flask_app.app_context():
+        gamechanger.db.drop_all()
+        gamechanger.db.create_all()
+        if isinstance(gamechanger.cache, gamechanger.MemoryCache):
+            gamechanger.cache._data.clear()
+        yield flask_app
+        gamechanger.db.session.remove()
+        gamechanger.db.drop_all()
+
+
+@pytest.fixture
+def smtp_server(app, monkeypatch):
+    """Point Flask-Mail at a local SMTPStub; its .outbox collects sent mail."""
+    server = SMTPStub().start()
+    for key, value in {
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": server.port,
+        "MAIL_USE_TLS": False,
+        "MAIL_USE_SSL": False,
+        "MAIL_USERNAME": None,
+        "MAIL_PASSWORD": None,
+        "MAIL_SUPPRESS_SEND": False,
+    }.items():
+        monkeypatch.setitem(app.config, key, value)
+    # Flask-Mail reads its settings once, when the extension is set up
+    monkeypatch.setitem(
+        app.extensions, "mail", gamechanger.mail.init_mail(app.config, app.debug, app.testing)
+    )
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def db(app):
+    return gamechanger.db
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user):
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user.id)
+        sess["_fresh"] = True
+
+
+@pytest.fixture
+def make_user(db):
+    counter = iter(range(1, 100000))
+
+    def make(role="hirer", **fields):
+        n = next(counter)
+        user = gamechanger.User(
+            name=fields.pop("name", f"User {n}"),
+            email=fields.pop("email", f"user{n}@example.com"),
+            role=role,
+            password_hash=PASSWORD_HASH,
+            **fields,
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return make
+
+
+@pytest.fixture
+def make_coach(db, make_user):
+    def make(name="Rahul Sharma", sport="Cricket", slug=None, **fields):
+        user = make_user(role="coach", name=name)
+        coach = gamechanger.Coach(
+            user_id=user.id,
+            slug=slug or gamechanger.create_slug(name, sport),
+            name=name,
+            sport=sport,
+            sports_prices=f'{{"{sport}": 500}}',
+            price_per_session=500,
+            city="Mumbai",
+            state="MH",
+            phone="9999999999",
+            experience_years=5,
+            age=30,
+            **fields,
+        )
+        coach.sync_search_keys()
+        db.session.add(coach)
+        db.session.commit()
+        db.session.add(gamechanger.CoachVenue(coach_id=coach.id, name="Ground", address="Addr"))
+        for day in range(7):
+            db.session.add(gamechanger.CoachAvailability(
+                coach_id=coach.id, day_of_week=day, start_time=time(6), end_time=time(22),
+            ))
+        db.session.commit()
+        return coach
+
+    return make
+
+
+@pytest.fixture
+def make_booking(db):
+    def make(coach, user, status="Confirmed", booking_date=None, booking_time="10:00", **fields):
+        booking = gamechanger.Booking(
+            coach_id=coach.id,
+            user_id=user.id,
+            sport=coach.sport,
+            booking_date=booking_date or date.today() + timedelta(days=3),
+            booking_time=booking_time,
+            status=status,
+            payment_mode=fields.pop("payment_mode", "online"),
+            **fields,
+        )
+        db.session.add(booking)
+        db.session.commit()
+        return booking
+
+    return make
@@ -0,0 +1,97 @@
+"""
+A local SMTP server for tests: accepts plain (no TLS, no auth) SMTP on
+127.0.0.1 and keeps every delivered message in `outbox`, so the outbox
+dispatcher can run end to end without a real mail provider.
+"""
+import socketserver
+import threading
+from email import message_from_bytes
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _SMTPHandler)
+        self.outbox = []  # email.message.Message objects, in delivery order
+        self.fail_next = 0  # reject this many upcoming transactions with a 451
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def take_failure(self):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+            return False
+
+    def deliver(self, envelope_to, data):
+        message = message_from_bytes(data)
+        message.envelope_to = envelope_to
+        with self._lock:
+            self.outbox.append(message)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost SMTP stub")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                recipients = []
+                if self.server.take_failure():
+                    self.reply("451 Temporary failure, try again later")
+                else:
+                    self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.deliver(recipients, self.read_data())
+                recipients = []
+                self.reply("250 OK: queued")
+            elif verb in ("RSET", "NOOP"):
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                break
+            if line.startswith(b".."):
+                line = line[1:]  # undo dot-stuffing
+            lines.append(line)
+        return b"".join(lines)
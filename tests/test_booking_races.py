@@ -0,0 +1,171 @@
+"""
+Concurrent bookings of one slot. Runs against SQLite by default; set
+TEST_DATABASE_URL=postgresql://... to run the same races against Postgres,
+and BOOKING_RACE_WORKERS to change how many attempts race for the slot.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import app as gamechanger
+from conftest import login
+
+WORKERS = int(os.getenv("BOOKING_RACE_WORKERS", "200"))
+
+
+def race(app, coach_id, user_ids, booking_date):
+    """Every worker tries to claim the same slot at once; returns the wins."""
+    barrier = threading.Barrier(len(user_ids))
+    results = []
+
+    def worker(user_id):
+        with app.app_context():
+            booking = gamechanger.Booking(
+                coach_id=coach_id,
+                user_id=user_id,
+                sport="Cricket",
+                booking_date=booking_date,
+                booking_time="10:00",
+                status="Payment Pending",
+                payment_mode="online",
+                locked_until=datetime.utcnow() + timedelta(minutes=10),
+            )
+            barrier.wait()
+            results.append(gamechanger.claim_slot(booking))
+            gamechanger.db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(uid,)) for uid in user_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def active_holders(db, coach_id, booking_date):
+    return db.session.scalar(
+        db.select(db.func.count(gamechanger.Booking.id)).where(
+            gamechanger.Booking.coach_id == coach_id,
+            gamechanger.Booking.booking_date == booking_date,
+            gamechanger.Booking.booking_time == "10:00",
+            gamechanger.Booking.status.in_(["Confirmed", "Payment Pending"]),
+        )
+    )
+
+
+def test_one_winner_per_slot(app, db, make_coach, make_user):
+    coach = make_coach()
+    users = [make_user().id for _ in range(WORKERS)]
+    day = datetime.utcnow().date() + timedelta(days=3)
+
+    results = race(app, coach.id, users, day)
+
+    assert results.count(True) == 1
+    assert active_holders(db, coach.id, day) == 1
+
+
+def test_expired_holder_is_replaced_once(app, db, make_coach, make_user, make_booking):
+    coach = make_coach()
+    day = datetime.utcnow().date() + timedelta(days=3)
+    stale = make_booking(
+        coach, make_user(), status="Payment Pending", booking_date=day,
+        locked_until=datetime.utcnow() - timedelta(minutes=1),
+    )
+    users = [make_user().id for _ in range(WORKERS)]
+
+    results = race(app, coach.id, users, day)
+
+    assert results.count(True) == 1
+    assert active_holders(db, coach.id, day) == 1
+    assert db.session.get(gamechanger.Booking, stale.id).status == "Cancelled"
+
+
+def test_reconfirming_taken_slot_is_rejected(client, db, make_coach, make_user, make_booking):
+    coach = make_coach()
+    day = datetime.utcnow().date() + timedelta(days=3)
+    rejected = make_booking(coach, make_user(), status="Rejected", booking_date=day)
+    make_booking(coach, make_user(), status="Confirmed", booking_date=day)
+    login(client, coach.user)
+
+    response = client.post(
+        f"/booking/{rejected.id}/status", data={"status": "Confirmed"}, follow_redirects=True
+    )
+
+    assert b"already booked" in response.data
+    db.session.expire_all()
+    assert db.session.get(gamechanger.Booking, rejected.id).status == "Rejected"
+    assert active_holders(db, coach.id, day) == 1
+
+
+def stub_checkout(monkeypatch):
+    monkeypatch.setattr(
+        gamechanger.stripe.checkout.Session, "create",
+        lambda **kwargs: SimpleNamespace(id="cs_test", url="https://checkout.stripe.test"),
+    )
+
+
+def booking_form(coach, day):
+    return {
+        "sport": "Cricket", "date": day.isoformat(), "time": "10:00",
+        "payment_mode": "online", "venue_type": "coach_venue", "venue_id": coach.venues[0].id,
+    }
+
+
+def test_insert_conflict_after_overlap_check(app, client, db, make_coach, make_user, monkeypatch):
+    coach = make_coach()
+    rival = make_user()
+    day = datetime.utcnow().date() + timedelta(days=3)
+    form = booking_form(coach, day)
+    stub_checkout(monkeypatch)
+    claim_slot = gamechanger.claim_slot
+
+    def rival_books_first(booking):
+        # Another worker commits the slot between the overlap check and our INSERT
+        with app.app_context():
+            assert claim_slot(gamechanger.Booking(
+                coach_id=booking.coach_id, user_id=rival.id, sport="Cricket",
+                booking_date=booking.booking_date, booking_time=booking.booking_time,
+                status="Confirmed", payment_mode="online",
+            ))
+            gamechanger.db.session.remove()
+        return claim_slot(booking)
+
+    monkeypatch.setattr(gamechanger, "claim_slot", rival_books_first)
+    login(client, make_user())
+
+    response = client.post(f"/book/{coach.id}", data=form, follow_redirects=True)
+
+    assert b"already booked" in response.data
+    assert active_holders(db, coach.id, day) == 1
+
+
+def test_one_winner_through_book_session(app, db, make_coach, make_user, monkeypatch):
+    coach = make_coach()
+    coach_id, slug = coach.id, coach.slug
+    clients = []
+    for _ in range(WORKERS):
+        clients.append(app.test_client())
+        login(clients[-1], make_user())
+    day = datetime.utcnow().date() + timedelta(days=3)
+    form = booking_form(coach, day)
+    stub_checkout(monkeypatch)
+
+    barrier = threading.Barrier(len(clients))
+    outcomes = []
+
+    def worker(client):
+        barrier.wait()
+        response = client.post(f"/book/{coach_id}", data=form)
+        outcomes.append(response.headers["Location"])
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(outcomes) == WORKERS
+    assert sum("/payment/" in location for location in outcomes) == 1
+    assert sum(location.endswith(f"/coaches/{slug}") for location in outcomes) == WORKERS - 1
+    assert active_holders(db, coach_id, day) == 1
@@ -0,0 +1,41 @@
+import app as gamechanger
+
+
+def seed_coaches(make_coach, n):
+    return [make_coach(name=f"Coach {i}", rating=float(i % 5)) for i in range(n)]
+
+
+def test_directory_defaults_to_cursor_pages(client, make_coach):
+    seed_coaches(make_coach, gamechanger.COACHES_PER_PAGE + 3)
+
+    first = client.get("/coaches?sport=Cricket")
+    assert first.status_code == 200
+    assert b"cursor=" in first.data
+    assert b"page=2" not in first.data
+
+    html = first.data.decode()
+    next_href = html.split('href="/coaches?cursor=', 1)[1].split('"', 1)[0]
+    second = client.get("/coaches?cursor=" + next_href.replace("&amp;", "&"))
+    assert second.status_code == 200
+    assert b"cursor=" not in second.data  # last page
+
+
+def test_page_links_still_work(client, make_coach):
+    seed_coaches(make_coach, gamechanger.COACHES_PER_PAGE + 3)
+
+    response = client.get("/coaches?page=2")
+    assert response.status_code == 200
+    assert b"page=1" in response.data
+
+
+def test_feed_next_url_carries_only_supplied_filters(client, make_coach):
+    seed_coaches(make_coach, gamechanger.COACHES_PER_PAGE + 3)
+
+    next_url = client.get("/api/coaches/feed").get_json()["next_url"]
+    assert next_url.startswith("/api/coaches/feed?cursor=")
+    assert "sport=" not in next_url and "city=" not in next_url and "price" not in next_url
+
+    next_url = client.get("/api/coaches/feed?city=Mumbai&price_min=0").get_json()["next_url"]
+    assert "city=Mumbai" in next_url and "price_min=0" in next_url
+    assert "sport=" not in next_url and "price_max" not in next_url
+    assert client.get(next_url).get_json()["html"]
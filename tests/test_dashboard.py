@@ -0,0 +1,21 @@
+import app as gamechanger
+from conftest import login
+
+
+def availability_item(client):
+    html = client.get("/dashboard").get_data(as_text=True)
+    return html.split("Weekly availability", 1)[1].split("</li>", 1)[0]
+
+
+def test_checklist_ignores_inactive_availability(client, db, make_coach):
+    coach = make_coach()
+    login(client, coach.user)
+    assert "✓" in availability_item(client)
+
+    # Unticked days are deactivated, not deleted
+    gamechanger.apply_weekly_availability(coach.id, {})
+    db.session.commit()
+    db.session.expire_all()
+
+    assert "Missing" in availability_item(client)
+    assert coach.calculate_completion_score() == coach.profile_completion
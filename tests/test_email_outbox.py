@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+
+import app as gamechanger
+
+
+def queue_email(subject="Booking confirmed", to="student@example.com"):
+    msg = Message(subject, recipients=[to])
+    msg.body = "See you on the field."
+    gamechanger.enqueue_email(msg)
+    return gamechanger.OutboundEmail.query.filter_by(subject=subject).one()
+
+
+def make_due(db, email):
+    """Skip the backoff wait instead of sleeping through it."""
+    email.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_dispatcher_delivers_through_smtp(db, smtp_server):
+    for i in range(5):
+        queue_email(subject=f"Newsletter {i}", to=f"fan{i}@example.com")
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        assert gamechanger.dispatch_pending_emails(executor) == (5, 0)
+
+    assert sorted(m["Subject"] for m in smtp_server.outbox) == [f"Newsletter {i}" for i in range(5)]
+    assert smtp_server.outbox[0].envelope_to[0].endswith("@example.com")
+    assert {e.status for e in gamechanger.OutboundEmail.query} == {"sent"}
+
+
+def test_temporary_failure_backs_off_then_sends(db, smtp_server):
+    email = queue_email()
+    smtp_server.fail_next = 1
+
+    assert gamechanger.claim_due_emails() == [email.id]
+    before = datetime.utcnow()
+    assert gamechanger.deliver_email(email.id) is False
+
+    db.session.expire_all()
+    assert (email.status, email.attempts) == ("queued", 1)
+    assert "451" in email.last_error
+    assert email.next_attempt_at >= before + timedelta(seconds=gamechanger.EMAIL_BACKOFF_SECONDS)
+    assert gamechanger.claim_due_emails() == []  # still backing off
+    assert smtp_server.outbox == []
+
+    make_due(db, email)
+    assert gamechanger.claim_due_emails() == [email.id]
+    assert gamechanger.deliver_email(email.id) is True
+
+    db.session.expire_all()
+    assert email.status == "sent"
+    assert [m["To"] for m in smtp_server.outbox] == ["student@example.com"]
+
+
+def test_backoff_doubles_until_the_email_fails(db, smtp_server):
+    email = queue_email()
+    smtp_server.fail_next = gamechanger.EMAIL_MAX_ATTEMPTS
+
+    delays = []
+    for _ in range(gamechanger.EMAIL_MAX_ATTEMPTS):
+        make_due(db, email)
+        assert gamechanger.claim_due_emails() == [email.id]
+        before = datetime.utcnow()
+        assert gamechanger.deliver_email(email.id) is False
+        db.session.expire_all()
+        delays.append(round((email.next_attempt_at - before).total_seconds()))
+
+    assert (email.status, email.attempts) == ("failed", gamechanger.EMAIL_MAX_ATTEMPTS)
+    backoff = gamechanger.EMAIL_BACKOFF_SECONDS
+    assert delays[:-1] == [backoff * 2 ** n for n in range(gamechanger.EMAIL_MAX_ATTEMPTS - 1)]
+    assert smtp_server.outbox == []
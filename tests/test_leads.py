@@ -0,0 +1,45 @@
+import app as gamechanger
+
+
+class FakeSheet:
+    def __init__(self, on_append=None, fail=False):
+        self.rows = []
+        self.on_append = on_append
+        self.fail = fail
+
+    def append_rows(self, rows):
+        if self.fail:
+            raise RuntimeError("quota exceeded")
+        if self.on_append:
+            self.on_append()
+        self.rows.extend(rows)
+
+
+def seed_leads(db, n):
+    for i in range(n):
+        gamechanger.save_lead(f"Lead {i}", "9999999999", f"lead{i}@example.com", "batting")
+
+
+def test_overlapping_flushes_write_each_lead_once(db, monkeypatch):
+    seed_leads(db, 5)
+    overlapping = []
+    # A second flusher (another worker) runs while the first waits on Sheets.
+    sheet = FakeSheet(on_append=lambda: overlapping.append(gamechanger.flush_leads_to_sheets()))
+    monkeypatch.setattr(gamechanger, "get_leads_worksheet", lambda: sheet)
+
+    assert gamechanger.flush_leads_to_sheets() == 5
+    assert overlapping == [0]
+    assert len(sheet.rows) == 5
+    assert gamechanger.flush_leads_to_sheets() == 0
+
+
+def test_failed_append_releases_the_lease(db, monkeypatch):
+    seed_leads(db, 3)
+    monkeypatch.setattr(gamechanger, "get_leads_worksheet", lambda: FakeSheet(fail=True))
+    monkeypatch.setattr(gamechanger, "reset_leads_worksheet", lambda: None)
+    assert gamechanger.flush_leads_to_sheets() == 0
+
+    sheet = FakeSheet()
+    monkeypatch.setattr(gamechanger, "get_leads_worksheet", lambda: sheet)
+    assert gamechanger.flush_leads_to_sheets() == 3
+    assert len(sheet.rows) == 3
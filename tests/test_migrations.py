@@ -0,0 +1,175 @@
+import json
+from datetime import date, datetime, time, timedelta
+
+import app as gamechanger
+
+
+def test_blocked_dates_move_out_of_json_once(db, make_coach):
+    day = date.today() + timedelta(days=5)
+    coach = make_coach(availability_json=json.dumps({day.isoformat(): {"blocked": True}}))
+
+    assert gamechanger.migrate_blocked_dates() == (1, 1)
+    db.session.expire_all()
+    assert coach.availability_json == "{}"
+
+    # The coach unblocks the date; re-running must not bring it back.
+    gamechanger.CoachBlockedDate.query.filter_by(coach_id=coach.id).delete()
+    db.session.commit()
+    assert gamechanger.migrate_blocked_dates() == (0, 0)
+    assert gamechanger.get_blocked_dates(coach.id, day) == set()
+
+
+# Schema the app shipped with before migrate-db existed.
+BASELINE_MISSING_TABLES = {
+    "schema_migration", "coach_sport", "coach_blocked_date", "outbound_email",
+    "newsletter_job", "lead",
+}
+BASELINE_MISSING_COLUMNS = {
+    "coach": {
+        "city_key", "review_count", "rating_sum", "image_variants", "badge_label",
+        "profile_completion", "updated_at",
+    },
+    "booking": {"start_minute", "end_minute", "price"},
+    "coach_availability": {"slot_template"},
+    "stripe_event": {
+        "event_type", "object_id", "stripe_created", "payload", "status", "attempts",
+        "next_attempt_at", "last_error", "processed_at",
+    },
+}
+
+
+def create_baseline_schema(db):
+    metadata = db.MetaData()
+    for table in db.metadata.sorted_tables:
+        if table.name in BASELINE_MISSING_TABLES:
+            continue
+        columns = []
+        for column in table.columns:
+            if column.name in BASELINE_MISSING_COLUMNS.get(table.name, ()):
+                continue
+            column = column._copy()
+            column.index = None
+            columns.append(column)
+        db.Table(table.name, metadata, *columns)
+    metadata.create_all(db.engine)
+    return metadata
+
+
+def seed_baseline(metadata, db):
+    tables = metadata.tables
+    day = date.today() + timedelta(days=3)
+    with db.engine.begin() as conn:
+        conn.execute(tables["user"].insert(), [
+            {"id": 1, "name": "Coach", "email": "coach@example.com", "password_hash": "x", "role": "coach"},
+            {"id": 2, "name": "Hirer", "email": "hirer@example.com", "password_hash": "x", "role": "hirer"},
+        ])
+        conn.execute(tables["coach"].insert(), {
+            "id": 1, "user_id": 1, "slug": "rahul-cricket", "name": "Rahul", "sport": "Cricket",
+            "price_per_session": 500, "city": "Mumbai", "state": "MH", "rating": 0.0,
+            "availability_json": json.dumps({day.isoformat(): {"blocked": True}}),
+        })
+        conn.execute(tables["coach_availability"].insert(), {
+            "coach_id": 1, "day_of_week": 0, "start_time": time(6), "end_time": time(10),
+            "slot_duration_minutes": 60, "max_sessions_per_day": 4, "is_active": True,
+        })
+        conn.execute(tables["booking"].insert(), {
+            "coach_id": 1, "user_id": 2, "sport": "Cricket", "booking_date": day,
+            "booking_time": "10:00", "status": "Confirmed", "created_at": datetime.utcnow(),
+        })
+
+
+def schema(db):
+    # Fresh connections: pooled SQLite ones can return cached PRAGMA results
+    db.engine.dispose()
+    inspector = db.inspect(db.engine)
+    return {
+        table: (
+            {c["name"] for c in inspector.get_columns(table)},
+            {i["name"] for i in inspector.get_indexes(table)},
+        )
+        for table in inspector.get_table_names()
+    }
+
+
+def test_migrations_bring_baseline_up_to_create_all(db):
+    db.drop_all()
+    db.create_all()
+    expected = schema(db)
+    db.drop_all()
+
+    seed_baseline(create_baseline_schema(db), db)
+    applied = gamechanger.run_migrations()
+
+    assert [v for v, _ in applied] == [v for v, _, _ in gamechanger.MIGRATIONS]
+    assert schema(db) == expected
+    assert gamechanger.run_migrations() == []
+    assert gamechanger.pending_migrations() == []
+
+    coach = gamechanger.Coach.query.one()
+    assert coach.city_key == "mumbai"
+    assert [link.sport_key for link in coach.sport_links] == ["cricket"]
+    assert coach.updated_at is not None
+    assert coach.availability_json == "{}"
+    assert len(coach.blocked_dates) == 1
+    booking = gamechanger.Booking.query.one()
+    assert (booking.start_minute, booking.end_minute) == (600, 600 + gamechanger.DEFAULT_SESSION_MINUTES)
+    assert gamechanger.CoachAvailability.query.one().slot_template
+
+
+def test_fresh_database_records_every_step(db):
+    db.drop_all()
+    assert len(gamechanger.run_migrations()) == len(gamechanger.MIGRATIONS)
+    assert gamechanger.pending_migrations() == []
+
+
+def test_duplicate_active_bookings_are_resolved_before_unique_index(db):
+    db.drop_all()
+    metadata = create_baseline_schema(db)
+    seed_baseline(metadata, db)  # booking 1: Confirmed, 10:00
+    day = date.today() + timedelta(days=3)
+    now = datetime.utcnow()
+    booking = {"coach_id": 1, "user_id": 2, "sport": "Cricket", "booking_date": day, "created_at": now}
+    with db.engine.begin() as conn:
+        conn.execute(metadata.tables["booking"].insert(), [
+            # 2: expired hold on the confirmed 10:00 slot
+            dict(booking, booking_time="10:00", status="Payment Pending",
+                 locked_until=now - timedelta(hours=1)),
+            # 3, 4: two live holds on 11:00
+            dict(booking, booking_time="11:00", status="Payment Pending",
+                 locked_until=now + timedelta(minutes=5)),
+            dict(booking, booking_time="11:00", status="Payment Pending",
+                 locked_until=now + timedelta(minutes=5)),
+            # 5: a live hold that lost to a confirmation (6) on 12:00
+            dict(booking, booking_time="12:00", status="Payment Pending",
+                 locked_until=now + timedelta(minutes=5)),
+            dict(booking, booking_time="12:00", status="Confirmed", locked_until=None),
+        ])
+
+    gamechanger.run_migrations()
+
+    statuses = dict(db.session.execute(
+        db.select(gamechanger.Booking.id, gamechanger.Booking.status)
+    ).all())
+    assert statuses == {
+        1: "Confirmed", 2: "Cancelled",
+        3: "Payment Pending", 4: "Cancelled",
+        5: "Cancelled", 6: "Confirmed",
+    }
+    assert gamechanger.pending_migrations() == []
+
+
+def test_reconcile_ratings_command_rebuilds_aggregates(app, db, make_coach, make_user):
+    coach = make_coach()
+    for rating in (5, 3):
+        db.session.add(gamechanger.Review(coach_id=coach.id, user_id=make_user().id, rating=rating))
+    db.session.commit()
+    db.session.execute(
+        db.update(gamechanger.Coach).values(review_count=0, rating_sum=0, rating=0.0)
+    )
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["reconcile-ratings"])
+
+    assert "1 coaches changed" in result.output
+    db.session.expire_all()
+    assert (coach.review_count, coach.rating_sum, coach.rating) == (2, 8, 4.0)
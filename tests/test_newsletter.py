@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import app as gamechanger
+
+
+def make_job(db, **fields):
+    job = gamechanger.NewsletterJob(subject="Summer camps", body="Sign up now.", **fields)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_job_sends_to_every_subscriber(db, smtp_server):
+    db.session.add_all(gamechanger.Subscriber(email=f"fan{i}@example.com") for i in range(12))
+    db.session.commit()
+    job = make_job(db)
+
+    gamechanger.run_newsletter_job(job.id)
+
+    db.session.expire_all()
+    assert (job.status, job.sent_count, job.failed_count) == ("done", 12, 0)
+    assert len(smtp_server.outbox) == 12
+
+
+def test_slow_slice_keeps_the_job_from_looking_stalled(db, smtp_server, monkeypatch):
+    # Stands in for a slice that runs longer than NEWSLETTER_STALE_MINUTES
+    monkeypatch.setattr(gamechanger, "NEWSLETTER_HEARTBEAT_SECONDS", 0)
+    stale = datetime.utcnow() - timedelta(minutes=gamechanger.NEWSLETTER_STALE_MINUTES + 1)
+    job = make_job(db, status="running", heartbeat_at=stale)
+
+    sent, failed = gamechanger.send_newsletter_batch(
+        job.id, job.subject, job.body, ["a@example.com", "b@example.com"]
+    )
+
+    assert (sent, failed) == (2, 0)
+    db.session.expire_all()
+    assert job.heartbeat_at > stale
+    assert gamechanger.claim_newsletter_job(job.id) is False  # "Resume" can't start a second runner
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+import pytest
+from flask import g
+
+import app as gamechanger
+from conftest import login
+
+BOOKINGS = 20
+REVIEWS = 15
+
+
+@pytest.fixture
+def busy_coach(db, make_coach, make_user, make_booking):
+    """A coach with a mix of bookings and reviews from different students."""
+    coach = make_coach()
+    statuses = ["Confirmed", "Pending", "Payment Pending", "Rejected", "Cancelled"]
+    for i in range(BOOKINGS):
+        make_booking(
+            coach, make_user(),
+            status=statuses[i % len(statuses)],
+            booking_date=date.today() + timedelta(days=i % 7 - 2),
+            booking_time=f"{6 + i % 14:02d}:00",
+            price=500,
+        )
+    for i in range(REVIEWS):
+        db.session.add(gamechanger.Review(
+            coach_id=coach.id, user_id=make_user().id, rating=1 + i % 5, comment=f"Review {i}",
+        ))
+    db.session.commit()
+    return coach
+
+
+def statements_for(client, url, expected=b"User "):
+    """Render url and return the SQL statement count the app recorded for it."""
+    with client:
+        response = client.get(url)
+        assert response.status_code == 200, url
+        # Rendered with the seeded rows, not an empty or redirect page
+        assert expected in response.data, url
+        return g.sql_statements
+
+
+def test_coach_detail_budget(client, busy_coach):
+    used = statements_for(client, f"/coaches/{busy_coach.slug}", expected=b"Ground")
+    assert used <= gamechanger.QUERY_BUDGETS["coach_detail"]
+
+
+@pytest.mark.parametrize("endpoint, url", [
+    ("coach_dashboard", "/dashboard"),
+    ("coach_bookings", "/dashboard/bookings"),
+])
+def test_coach_dashboard_budgets(client, busy_coach, endpoint, url):
+    login(client, busy_coach.user)
+    used = statements_for(client, url)
+    assert used <= gamechanger.QUERY_BUDGETS[endpoint]
+
+
+def test_admin_dashboard_budget(app, client, busy_coach, make_user, monkeypatch):
+    admin = make_user(email="admin@example.com")
+    monkeypatch.setitem(app.config, "MAIL_USERNAME", admin.email)
+    login(client, admin)
+    used = statements_for(client, "/admin")
+    assert used <= gamechanger.QUERY_BUDGETS["admin_dashboard"]
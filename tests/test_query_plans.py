@@ -0,0 +1,12 @@
+import app as gamechanger
+
+
+def test_hot_queries_use_an_index(app):
+    full_scans = {}
+    for name, statement in gamechanger.hot_queries().items():
+        lines, scans = gamechanger.explain_full_scans(statement)
+        assert lines, name
+        if scans:
+            full_scans[name] = lines
+
+    assert full_scans == {}
@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import app as gamechanger
+
+SEEDED = 1000
+COACH_ROW = {"name": "Rahul", "sport": "Cricket", "price_per_session": 500, "city": "Mumbai", "state": "MH"}
+
+
+@pytest.fixture
+def seeded_slugs(db, make_user):
+    """rahul-cricket, rahul-cricket-2 ... rahul-cricket-1000."""
+    user = make_user(role="coach")
+    slugs = ["rahul-cricket"] + [f"rahul-cricket-{n}" for n in range(2, SEEDED + 1)]
+    db.session.execute(gamechanger.Coach.__table__.insert(), [
+        dict(COACH_ROW, user_id=user.id, slug=slug) for slug in slugs
+    ])
+    db.session.commit()
+    return slugs
+
+
+@pytest.fixture
+def statements(db):
+    seen = []
+
+    def count(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    db.event.listen(db.engine, "before_cursor_execute", count)
+    yield seen
+    db.event.remove(db.engine, "before_cursor_execute", count)
+
+
+def new_coach(user):
+    return gamechanger.Coach(user_id=user.id, **COACH_ROW)
+
+
+def test_next_slug_is_one_query(seeded_slugs, statements):
+    assert gamechanger.create_slug("Rahul", "Cricket") == f"rahul-cricket-{SEEDED + 1}"
+    assert len(statements) == 1
+
+
+def test_slug_race_retries_with_next_suffix(db, seeded_slugs, make_user, monkeypatch):
+    rival = make_user(role="coach")
+    create_slug = gamechanger.create_slug
+    calls = []
+
+    def create_slug_then_lose_race(name, sport_str):
+        slug = create_slug(name, sport_str)
+        if not calls:
+            # A concurrent signup commits the same slug first.
+            with db.engine.begin() as conn:
+                conn.execute(
+                    gamechanger.Coach.__table__.insert(),
+                    dict(COACH_ROW, user_id=rival.id, slug=slug),
+                )
+        calls.append(slug)
+        return slug
+
+    monkeypatch.setattr(gamechanger, "create_slug", create_slug_then_lose_race)
+    coach = new_coach(make_user(role="coach"))
+    gamechanger.insert_coach(coach, "Rahul", "Cricket")
+
+    assert calls == [f"rahul-cricket-{SEEDED + 1}", f"rahul-cricket-{SEEDED + 2}"]
+    assert coach.slug == f"rahul-cricket-{SEEDED + 2}"
+
+
+def test_other_integrity_errors_are_not_retried(db, make_user, monkeypatch):
+    calls = []
+    create_slug = gamechanger.create_slug
+    monkeypatch.setattr(gamechanger, "create_slug", lambda *a: calls.append(1) or create_slug(*a))
+    coach = new_coach(make_user(role="coach"))
+    coach.price_per_session = None  # NOT NULL violation, not a slug clash
+
+    with pytest.raises(IntegrityError):
+        gamechanger.insert_coach(coach, "Rahul", "Cricket")
+    assert len(calls) == 1
@@ -0,0 +1,133 @@
+import json
+from datetime import datetime, timedelta
+
+import app as gamechanger
+
+_created = iter(range(1_700_000_000, 1_800_000_000))
+
+
+def queue_event(db, booking_id, object_id="cs_test_1", **fields):
+    event_id = f"evt_{next(_created)}"
+    payload = {
+        "id": event_id,
+        "type": "checkout.session.completed",
+        "created": next(_created),
+        "data": {"object": {
+            "id": object_id,
+            "payment_intent": "pi_test",
+            "metadata": {"type": "coach_booking", "booking_id": str(booking_id)},
+        }},
+    }
+    row = gamechanger.StripeEvent(
+        event_id=event_id,
+        event_type=payload["type"],
+        object_id=object_id,
+        stripe_created=payload["created"],
+        payload=json.dumps(payload),
+        **fields,
+    )
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def test_payment_confirms_pending_booking(db, make_coach, make_user, make_booking):
+    booking = make_booking(make_coach(), make_user(), status="Payment Pending")
+    event = queue_event(db, booking.id)
+
+    assert gamechanger.process_stripe_events() == (1, 0)
+
+    db.session.expire_all()
+    assert booking.status == "Confirmed"
+    assert booking.payment_status == "success"
+    assert event.status == "processed"
+
+
+def expired_hold(coach, user, make_booking):
+    """A Payment Pending booking the lock sweeper has cancelled."""
+    booking = make_booking(
+        coach, user, status="Payment Pending",
+        locked_until=datetime.utcnow() - timedelta(minutes=1),
+    )
+    assert gamechanger.release_expired_locks() == 1
+    return booking
+
+
+def test_late_payment_reconfirms_swept_booking_if_slot_is_free(db, make_coach, make_user, make_booking):
+    booking = expired_hold(make_coach(), make_user(), make_booking)
+    queue_event(db, booking.id)
+
+    assert gamechanger.process_stripe_events() == (1, 0)
+
+    db.session.expire_all()
+    assert booking.status == "Confirmed"
+    assert booking.payment_status == "success"
+
+
+def test_late_payment_for_resold_slot_is_flagged_for_refund(db, make_coach, make_user, make_booking):
+    coach = make_coach()
+    cancelled = expired_hold(coach, make_user(), make_booking)
+    make_booking(coach, make_user(), status="Confirmed")  # slot re-sold meanwhile
+    event = queue_event(db, cancelled.id)
+
+    assert gamechanger.process_stripe_events() == (1, 0)
+
+    db.session.expire_all()
+    assert cancelled.status == "Cancelled"
+    assert cancelled.payment_status == "refund_due"
+    assert event.status == "processed"
+    assert event.attempts == 0
+    notified = {e.recipients for e in gamechanger.OutboundEmail.query.filter_by(
+        subject="Paid booking needs a refund"
+    )}
+    assert notified == {f'["{coach.user.email}"]'}
+
+    # A replayed event leaves the refund flag alone, even once the slot frees up
+    gamechanger.Booking.query.filter_by(status="Confirmed").update({"status": "Rejected"})
+    db.session.commit()
+    queue_event(db, cancelled.id, object_id="cs_replay")
+    assert gamechanger.process_stripe_events() == (1, 0)
+    db.session.expire_all()
+    assert (cancelled.status, cancelled.payment_status) == ("Cancelled", "refund_due")
+
+
+def test_payment_for_rejected_booking_is_flagged_for_refund(db, make_coach, make_user, make_booking):
+    rejected = make_booking(make_coach(), make_user(), status="Rejected")
+    queue_event(db, rejected.id)
+
+    assert gamechanger.process_stripe_events() == (1, 0)
+
+    db.session.expire_all()
+    assert (rejected.status, rejected.payment_status) == ("Rejected", "refund_due")
+
+
+def test_events_in_backoff_do_not_stall_the_queue(db, make_coach, make_user, make_booking):
+    coach = make_coach()
+    later = datetime.utcnow() + timedelta(hours=1)
+    # A full batch of old events that are backing off or leased elsewhere.
+    for i in range(gamechanger.STRIPE_EVENT_BATCH):
+        queue_event(db, 0, object_id=f"cs_old_{i}", next_attempt_at=later,
+                    status="processing" if i % 2 else "queued")
+    booking = make_booking(coach, make_user(), status="Payment Pending")
+    queue_event(db, booking.id, object_id="cs_new")
+
+    assert gamechanger.process_stripe_events() == (1, 0)
+    db.session.expire_all()
+    assert booking.status == "Confirmed"
+
+
+def test_later_event_waits_for_earlier_one_on_same_object(db, make_coach, make_user, make_booking):
+    booking = make_booking(make_coach(), make_user(), status="Payment Pending")
+    first = queue_event(db, booking.id, next_attempt_at=datetime.utcnow() + timedelta(hours=1))
+    second = queue_event(db, booking.id)
+
+    assert gamechanger.process_stripe_events() == (0, 0)
+    db.session.expire_all()
+    assert second.status == "queued"
+
+    first.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert gamechanger.process_stripe_events() == (1, 0)
+    assert gamechanger.process_stripe_events() == (1, 0)
+    db.session.expire_all()
+    assert (first.status, second.status) == ("processed", "processed")